@@ -0,0 +1,191 @@
+"""
+Niobium batch — send smart-mode Claude requests through the Message Batches API.
+
+With --batch a run goes through its inputs twice. The first pass delivers
+nothing: smart_generate_cards and smart_filter_results add each request
+that is not in the Claude cache to a BatchCollector. The collected
+requests are submitted as Message Batches, split to stay under the API's
+per-batch limits (BATCH_LIMITS). Results are written to the Claude cache
+under the same keys as live calls, and the second pass is an ordinary run
+that finds every response in the cache.
+
+Each batch id is stored in cache.db under a key built from its request
+ids, so a run that is interrupted while batches are processing picks the
+same batches up again when it is started with the same inputs and
+settings.
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from rich.console import Console
+
+from anki_niobium.cache import get_batch_job, set_batch_job, set_cached_claude_response
+from anki_niobium.llm import _get_client, _parse_response_json, _usage_cost, _usage_tokens
+from anki_niobium.theme import S
+
+console = Console()
+
+# Message Batches are billed at half the price of live requests
+_BATCH_DISCOUNT = 0.5
+
+# Most requests and request bytes the API accepts in one Message Batch
+BATCH_LIMITS = {
+    "requests": 100_000,
+    "bytes": 256 * 1000 * 1000,  # 256 MB, counted in decimal megabytes to stay on the safe side
+}
+# Bytes of the {"requests": [...]} envelope around the requests
+_ENVELOPE_BYTES = 64
+
+
+class BatchCollector:
+    """Claude requests collected during a --batch collect pass, keyed by custom_id.
+
+    limits overrides BATCH_LIMITS entries.
+    """
+
+    def __init__(self, config, limits=None):
+        llm_config = config.get("llm", {})
+        self.api_key = llm_config.get("api_key") or os.environ.get("ANTHROPIC_API_KEY")
+        if not self.api_key:
+            console.print(f"[{S.error}]No API key found. --batch requires ANTHROPIC_API_KEY.[/{S.error}]")
+            raise ValueError("API key required for batch mode")
+        self.base_url = llm_config.get("base_url")
+        self.poll_interval = llm_config.get("batch_poll_interval", 30)
+        self.limits = {**BATCH_LIMITS, **(limits or {})}
+        self.requests = {}
+
+    def add(self, cache_args, params, postprocess=None):
+        """Queue one Messages request.
+
+        cache_args are the arguments of set_cached_claude_response before the
+        response itself, params the messages.create arguments. postprocess,
+        if given, adjusts the parsed response in place before it is cached.
+        Identical requests are queued once.
+        """
+        custom_id = hashlib.sha256(json.dumps(cache_args, default=str).encode("utf-8")).hexdigest()
+        self.requests[custom_id] = (cache_args, params, postprocess)
+
+    def _chunks(self, ids):
+        """Split custom ids into lists that each fit in one Message Batch (self.limits).
+
+        A request too large for a batch of its own is left out, so the
+        second pass sends it live.
+        """
+        chunk, size = [], _ENVELOPE_BYTES
+        for custom_id in ids:
+            entry = {"custom_id": custom_id, "params": self.requests[custom_id][1]}
+            # +2 for the separator between requests
+            entry_size = len(json.dumps(entry).encode("utf-8")) + 2
+            if _ENVELOPE_BYTES + entry_size > self.limits["bytes"]:
+                console.print(f"[{S.accent2}]Request {custom_id[:12]} is too large for a Message Batch; it is sent individually[/{S.accent2}]")
+                continue
+            if chunk and (len(chunk) >= self.limits["requests"] or size + entry_size > self.limits["bytes"]):
+                yield chunk
+                chunk, size = [], _ENVELOPE_BYTES
+            chunk.append(custom_id)
+            size += entry_size
+        if chunk:
+            yield chunk
+
+    def _submit(self, client, chunk, label):
+        """Submit one chunk of requests, or resume its batch. Returns (job_key, batch_id)."""
+        job_key = hashlib.sha256("\n".join(chunk).encode("utf-8")).hexdigest()
+        # A batch that ended is not resumed: its failed requests are submitted again
+        job = get_batch_job(job_key)
+        if job and job["status"] != "ended":
+            batch_id = job["batch_id"]
+            console.print(f"[{S.accent}]Resuming Message Batch {batch_id}{label} ({len(chunk)} requests)[/{S.accent}]")
+        else:
+            batch = client.messages.batches.create(requests=[
+                {"custom_id": custom_id, "params": self.requests[custom_id][1]} for custom_id in chunk
+            ])
+            batch_id = batch.id
+            set_batch_job(job_key, batch_id, len(chunk), batch.processing_status)
+            console.print(f"[{S.accent}]Submitted Message Batch {batch_id}{label} ({len(chunk)} requests)[/{S.accent}]")
+        return job_key, batch_id
+
+    def run(self):
+        """Submit the collected requests (or resume their batches), wait for them and cache the results.
+
+        Returns the number of responses cached. Requests that fail in a
+        batch are left out of the cache, so the second pass sends them live.
+        """
+        if not self.requests:
+            return 0
+        client = _get_client(self.api_key, self.base_url)
+        chunks = list(self._chunks(sorted(self.requests)))
+        jobs = {}
+        for k, chunk in enumerate(chunks, 1):
+            label = f" (part {k}/{len(chunks)})" if len(chunks) > 1 else ""
+            job_key, batch_id = self._submit(client, chunk, label)
+            jobs[batch_id] = (job_key, len(chunk))
+        if not jobs:
+            return 0
+
+        pending = list(jobs)
+        while True:
+            still_processing = []
+            processing = succeeded = errored = 0
+            for batch_id in pending:
+                job_key, size = jobs[batch_id]
+                batch = client.messages.batches.retrieve(batch_id)
+                set_batch_job(job_key, batch_id, size, batch.processing_status)
+                if batch.processing_status != "ended":
+                    still_processing.append(batch_id)
+                    counts = batch.request_counts
+                    processing += counts.processing
+                    succeeded += counts.succeeded
+                    errored += counts.errored
+            pending = still_processing
+            if not pending:
+                break
+            name = f"Batch {pending[0]}" if len(jobs) == 1 else f"{len(pending)} batches"
+            console.print(
+                f"[{S.muted}]{name}: {processing} processing, "
+                f"{succeeded} succeeded, {errored} errored "
+                f"— checking again in {self.poll_interval}s[/{S.muted}]"
+            )
+            time.sleep(self.poll_interval)
+
+        cached = failed = 0
+        input_tokens = output_tokens = cache_read = 0
+        cost = 0.0
+        name = f"Batch {next(iter(jobs))}" if len(jobs) == 1 else f"{len(jobs)} batches"
+        entries = (entry for batch_id in jobs for entry in client.messages.batches.results(batch_id))
+        for entry in entries:
+            request = self.requests.get(entry.custom_id)
+            if request is None:
+                continue
+            cache_args, params, postprocess = request
+            if entry.result.type != "succeeded":
+                failed += 1
+                continue
+            message = entry.result.message
+            tokens = _usage_tokens(message.usage)
+            input_tokens += tokens[0]
+            output_tokens += tokens[1]
+            cache_read += tokens[3]
+            cost += _usage_cost(message.usage, params["model"]) * _BATCH_DISCOUNT
+            try:
+                data = _parse_response_json(message.content[0].text)
+            except (ValueError, IndexError, AttributeError):
+                failed += 1
+                continue
+            if postprocess:
+                postprocess(data)
+            set_cached_claude_response(*cache_args, data)
+            cached += 1
+
+        console.print(
+            f"[{S.success}]{name} ended: {cached} response(s) cached[/{S.success}]"
+            + (f" [{S.accent2}]({failed} failed, sent individually)[/{S.accent2}]" if failed else "")
+        )
+        cache = f" | {cache_read:,} read from prompt cache" if cache_read else ""
+        console.print(
+            f"[{S.muted}]  tokens: {input_tokens:,} in / {output_tokens:,} out{cache} "
+            f"| cost: ${cost:.4f} (batch pricing)[/{S.muted}]"
+        )
+        return cached
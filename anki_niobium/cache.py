@@ -1,5 +1,6 @@
 """
-Niobium cache — tracks processed images and caches Claude API responses.
+Niobium cache — tracks processed images and caches OCR results, PDF page
+analysis and Claude API responses.
 
 DB location: ~/.config/niobium/cache.db
 """
@@ -7,6 +8,7 @@ DB location: ~/.config/niobium/cache.db
 import sqlite3
 import hashlib
 import json
+import threading
 import time
 from pathlib import Path
 
@@ -14,18 +16,35 @@ CACHE_DIR = Path.home() / ".config" / "niobium"
 CACHE_DB = CACHE_DIR / "cache.db"
 
 _conn = None
+# One connection is shared by the pipeline threads; every statement runs under this lock.
+_lock = threading.RLock()
 
 
 def _get_conn():
     global _conn
-    if _conn is None:
-        CACHE_DIR.mkdir(parents=True, exist_ok=True)
-        _conn = sqlite3.connect(str(CACHE_DB))
-        _conn.execute("PRAGMA journal_mode=WAL")
-        _init_tables(_conn)
+    with _lock:
+        if _conn is None:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            _conn = sqlite3.connect(str(CACHE_DB), check_same_thread=False)
+            _conn.execute("PRAGMA journal_mode=WAL")
+            _init_tables(_conn)
     return _conn
 
 
+def _execute(sql, params=()):
+    """Run a read statement and return all rows."""
+    with _lock:
+        return _get_conn().execute(sql, params).fetchall()
+
+
+def _write(sql, params=()):
+    """Run a write statement and commit."""
+    with _lock:
+        conn = _get_conn()
+        conn.execute(sql, params)
+        conn.commit()
+
+
 def _init_tables(conn):
     conn.execute("""
         CREATE TABLE IF NOT EXISTS processed (
@@ -45,6 +64,31 @@ def _init_tables(conn):
         conn.execute("ALTER TABLE processed ADD COLUMN artifacts_path TEXT")
     except sqlite3.OperationalError:
         pass
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ocr_cache (
+            cache_key      TEXT PRIMARY KEY,
+            results_json   TEXT,
+            created_at     REAL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS page_cache (
+            cache_key      TEXT PRIMARY KEY,
+            page_json      TEXT,
+            image_png      BLOB,
+            created_at     REAL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS batch_jobs (
+            job_key        TEXT PRIMARY KEY,
+            batch_id       TEXT,
+            requests       INTEGER,
+            status         TEXT,
+            created_at     REAL,
+            updated_at     REAL
+        )
+    """)
     conn.execute("""
         CREATE TABLE IF NOT EXISTS claude_cache (
             cache_key      TEXT PRIMARY KEY,
@@ -74,20 +118,77 @@ def content_hash_bytes(data):
 
 def is_processed(content_hash):
     """Check if content was already processed. Returns dict with paths if found, None otherwise."""
-    row = _get_conn().execute(
+    rows = _execute(
         "SELECT source, output_path, artifacts_path FROM processed WHERE content_hash = ?", (content_hash,)
-    ).fetchone()
-    if row is not None:
+    )
+    if rows:
+        row = rows[0]
         return {"source": row[0], "output_path": row[1], "artifacts_path": row[2]}
     return None
 
 
 def mark_processed(content_hash, source, output_path=None, artifacts_path=None):
-    _get_conn().execute(
+    _write(
         "INSERT OR REPLACE INTO processed (content_hash, source, processed_at, output_path, artifacts_path) VALUES (?, ?, ?, ?, ?)",
         (content_hash, source, time.time(), output_path, artifacts_path),
     )
-    _get_conn().commit()
+
+
+# ── OCR result cache ─────────────────────────────────────────────────
+
+def _ocr_cache_key(image_hash, langs, options):
+    parts = f"{image_hash}\n{langs}\n{json.dumps(options or {}, sort_keys=True, default=str)}"
+    return hashlib.sha256(parts.encode("utf-8")).hexdigest()
+
+
+def get_cached_ocr(image_hash, langs, options=None):
+    """Return cached raw OCR output as a list of (bbox, text, prob) tuples, or None."""
+    key = _ocr_cache_key(image_hash, langs, options)
+    rows = _execute("SELECT results_json FROM ocr_cache WHERE cache_key = ?", (key,))
+    if rows:
+        return [(bbox, text, prob) for bbox, text, prob in json.loads(rows[0][0])]
+    return None
+
+
+def set_cached_ocr(image_hash, langs, options, results):
+    key = _ocr_cache_key(image_hash, langs, options)
+    # EasyOCR returns numpy scalars; unwrap them so the results are JSON-safe
+    num = lambda v: v.item() if hasattr(v, "item") else v
+    data = [
+        ([[num(x), num(y)] for x, y in bbox], text, float(prob))
+        for bbox, text, prob in results
+    ]
+    _write(
+        "INSERT OR REPLACE INTO ocr_cache (cache_key, results_json, created_at) VALUES (?, ?, ?)",
+        (key, json.dumps(data), time.time()),
+    )
+
+
+# ── PDF page-analysis cache ──────────────────────────────────────────
+
+def _page_cache_key(page_hash, settings):
+    parts = f"{page_hash}\n{json.dumps(settings, sort_keys=True, default=str)}"
+    return hashlib.sha256(parts.encode("utf-8")).hexdigest()
+
+
+def get_cached_page(page_hash, settings):
+    """Return (page data dict, rendered PNG bytes or None) for a cached page, or None.
+
+    page_hash is the page fingerprint (see PdfSession.page_fingerprint).
+    """
+    key = _page_cache_key(page_hash, settings)
+    rows = _execute("SELECT page_json, image_png FROM page_cache WHERE cache_key = ?", (key,))
+    if rows:
+        return json.loads(rows[0][0]), rows[0][1]
+    return None
+
+
+def set_cached_page(page_hash, settings, page_data, image_png=None):
+    key = _page_cache_key(page_hash, settings)
+    _write(
+        "INSERT OR REPLACE INTO page_cache (cache_key, page_json, image_png, created_at) VALUES (?, ?, ?, ?)",
+        (key, json.dumps(page_data), image_png, time.time()),
+    )
 
 
 # ── Claude response cache ────────────────────────────────────────────
@@ -99,34 +200,57 @@ def _claude_cache_key(image_bytes_hash, text_list_json, model, instructions):
 
 def get_cached_claude_response(image_bytes_hash, text_list_json, model, instructions):
     key = _claude_cache_key(image_bytes_hash, text_list_json, model, instructions)
-    row = _get_conn().execute(
-        "SELECT response_json FROM claude_cache WHERE cache_key = ?", (key,)
-    ).fetchone()
-    if row is not None:
-        return json.loads(row[0])
+    rows = _execute("SELECT response_json FROM claude_cache WHERE cache_key = ?", (key,))
+    if rows:
+        return json.loads(rows[0][0])
     return None
 
 
 def set_cached_claude_response(image_bytes_hash, text_list_json, model, instructions, response_data):
     key = _claude_cache_key(image_bytes_hash, text_list_json, model, instructions)
-    _get_conn().execute(
+    _write(
         "INSERT OR REPLACE INTO claude_cache (cache_key, response_json, model, created_at) VALUES (?, ?, ?, ?)",
         (key, json.dumps(response_data), model, time.time()),
     )
-    _get_conn().commit()
+
+
+# ── Message Batch jobs ───────────────────────────────────────────────
+
+def get_batch_job(job_key):
+    """Return the submitted batch for a set of requests as a dict, or None."""
+    rows = _execute("SELECT batch_id, requests, status, created_at FROM batch_jobs WHERE job_key = ?", (job_key,))
+    if rows:
+        batch_id, requests, status, created_at = rows[0]
+        return {"batch_id": batch_id, "requests": requests, "status": status, "created_at": created_at}
+    return None
+
+
+def set_batch_job(job_key, batch_id, requests, status):
+    now = time.time()
+    _write(
+        "INSERT INTO batch_jobs (job_key, batch_id, requests, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(job_key) DO UPDATE SET batch_id = excluded.batch_id, requests = excluded.requests, "
+        "status = excluded.status, updated_at = excluded.updated_at",
+        (job_key, batch_id, requests, status, now, now),
+    )
 
 
 # ── Maintenance ──────────────────────────────────────────────────────
 
 def clear_all():
-    conn = _get_conn()
-    conn.execute("DELETE FROM processed")
-    conn.execute("DELETE FROM claude_cache")
-    conn.commit()
+    with _lock:
+        conn = _get_conn()
+        conn.execute("DELETE FROM processed")
+        conn.execute("DELETE FROM ocr_cache")
+        conn.execute("DELETE FROM page_cache")
+        conn.execute("DELETE FROM claude_cache")
+        conn.execute("DELETE FROM batch_jobs")
+        conn.commit()
 
 
 def stats():
-    conn = _get_conn()
-    p = conn.execute("SELECT COUNT(*) FROM processed").fetchone()[0]
-    c = conn.execute("SELECT COUNT(*) FROM claude_cache").fetchone()[0]
-    return {"processed": p, "claude_cache": c}
+    p = _execute("SELECT COUNT(*) FROM processed")[0][0]
+    o = _execute("SELECT COUNT(*) FROM ocr_cache")[0][0]
+    g = _execute("SELECT COUNT(*) FROM page_cache")[0][0]
+    c = _execute("SELECT COUNT(*) FROM claude_cache")[0][0]
+    return {"processed": p, "ocr_cache": o, "page_cache": g, "claude_cache": c}
@@ -91,7 +91,7 @@ def main():
         from anki_niobium.cache import clear_all, stats, CACHE_DB
         s = stats()
         clear_all()
-        console.print(f"[{S.success}]Cache cleared ({s['processed']} processed entries, {s['claude_cache']} Claude responses)[/{S.success}]")
+        console.print(f"[{S.success}]Cache cleared ({s['processed']} processed entries, {s['ocr_cache']} OCR results, {s['page_cache']} PDF pages, {s['claude_cache']} Claude responses)[/{S.success}]")
         console.print(f"[{S.muted}]{CACHE_DB}[/{S.muted}]")
         return
 
@@ -150,20 +150,23 @@ def main():
         help="force a specific card type (requires --smart with --page or --generate)")
     ap.add_argument("--no-cache", action="store_true", default=False,
         help="skip the cache for this run (does not clear existing cache)")
+    ap.add_argument("--batch", action="store_true", default=False,
+        help="send Claude requests as one Message Batch at half price; resumed when run again (requires --smart)")
+    ap.add_argument("--workers", type=int, default=1,
+        help="number of worker processes for OCR (-dir/-pin) and PDF page analysis (--smart -pin)")
     args = vars(ap.parse_args())
 
     if args.get('page') and not args.get('single_pdf'):
         ap.error("--page requires -pin/--single-pdf")
     if args.get('generate') and not args.get('smart'):
         ap.error("--generate requires --smart")
-    # Default to all pages when --generate + -pin but no --page
-    if args.get('generate') and args.get('single_pdf') and not args.get('page'):
-        import fitz
-        doc = fitz.Document(args['single_pdf'])
-        total = doc.page_count
-        doc.close()
-        args['page'] = f"1-{total}"
-
+    if args.get('batch') and not args.get('smart'):
+        ap.error("--batch requires --smart")
+    if args.get('batch') and args.get('no_cache'):
+        # The second pass reads the batch results and the first pass's work from the cache
+        ap.error("--batch cannot be combined with --no-cache")
+    if args.get('workers') is not None and args['workers'] < 1:
+        ap.error("--workers must be at least 1")
     # Resolve default output directory from work_dir when needed
     needs_default = (
         (not args.get('deck_name') and not args.get('pdf_img_out') and not args.get('apkg_out'))
@@ -184,34 +187,39 @@ def main():
         args['config'] = cfg_path
 
     nb = niobium(args)
-
-    if nb.smart:
-        nb.confirm_smart_instructions()
-
-    # Determine if we're in generation-first mode
-    # --generate flag for images, or --smart --page for PDFs (implicit generate)
-    is_generate = nb.generate or (nb.smart and nb.page and args.get('single_pdf'))
-
-    if args['pdf_img_out']:
-        if args['single_pdf'] == None:
-            raise Exception('--single-pdf must be passed for --pdf-img-out')
-        import fitz
-        doc = fitz.Document(args['single_pdf'])
-        page_set = niobium.parse_page_range(nb.page, doc.page_count, doc=doc) if nb.page else None
-        doc.close()
-        nb.extract_images_from_pdf(args['single_pdf'],args['pdf_img_out'],pages=page_set)
-    elif args['apkg_out']:
-        if is_generate:
-            nb.smart_generate_export_apkg()
-        else:
-            nb.export_apkg()
-    elif args['basic_type']:
-        nb.pdf_to_basic(args['directory'],args['deck_name'])
-    else:
-        if is_generate:
-            nb.smart_generate_to_deck()
+    try:
+        # Default to all pages when --generate + -pin but no --page
+        if nb.generate and nb.pdf and not nb.page:
+            nb.page = f"1-{nb.pdf.page_count}"
+
+        if nb.smart:
+            nb.confirm_smart_instructions()
+
+        # Determine if we're in generation-first mode
+        # --generate flag for images, or --smart --page for PDFs (implicit generate)
+        is_generate = nb.generate or (nb.smart and nb.page and args.get('single_pdf'))
+
+        run = None
+        if args['pdf_img_out']:
+            if args['single_pdf'] == None:
+                raise Exception('--single-pdf must be passed for --pdf-img-out')
+            page_set = niobium.parse_page_range(nb.page, nb.pdf.page_count, doc=nb.pdf) if nb.page else None
+            nb.extract_images_from_pdf(nb.pdf,args['pdf_img_out'],pages=page_set,raw=nb.pdf_raw_images)
+        elif args['apkg_out']:
+            run = nb.smart_generate_export_apkg if is_generate else nb.export_apkg
+        elif args['basic_type']:
+            nb.pdf_to_basic(args['directory'],args['deck_name'])
         else:
-            nb.ocr4io()
+            run = nb.smart_generate_to_deck if is_generate else nb.ocr4io
+
+        if run:
+            # --batch: Claude requests go out as one Message Batch between two passes
+            if nb.batch:
+                nb.run_batched(run)
+            else:
+                run()
+    finally:
+        nb.close()
 
 if __name__ == "__main__":
     main()
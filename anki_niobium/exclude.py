@@ -0,0 +1,55 @@
+"""
+Niobium exclude rules — the compiled form of the `exclude` config section.
+
+Exclusion lists are shared between decks and can hold thousands of entries,
+so they are compiled once: exact entries into a set of lowercased strings and
+regex entries into one combined pattern. Checking an OCR region is then a
+couple of set lookups and one regex search.
+"""
+
+import re
+from functools import lru_cache
+
+# Patterns that cannot be joined into one alternation without changing their
+# meaning or failing to compile: numbered/named backreferences, named groups
+# (two rules may use the same name) and global inline flags.
+_UNSAFE_TO_COMBINE = re.compile(r"\\[1-9]|\(\?P[<=]|^\(\?[aiLmsux]+\)")
+
+
+def reverse_word_order(text):
+    """text with its whitespace-separated words in reverse order."""
+    return " ".join(text.split()[::-1])
+
+
+class ExcludeRules:
+    """Compiled exclude.exact / exclude.regex rules."""
+
+    def __init__(self, exact=(), regex=()):
+        self.exact = frozenset(e.lower() for e in exact)
+        combinable = [p for p in regex if not _UNSAFE_TO_COMBINE.search(p)]
+        self.patterns = [re.compile(p) for p in regex if _UNSAFE_TO_COMBINE.search(p)]
+        if combinable:
+            try:
+                self.patterns.insert(0, re.compile("|".join(f"(?:{p})" for p in combinable)))
+            except re.error:
+                # Valid on their own but not together; check them one by one
+                self.patterns[:0] = [re.compile(p) for p in combinable]
+
+    @staticmethod
+    def from_config(exclude_cfg):
+        exclude_cfg = exclude_cfg or {}
+        return _compile(tuple(exclude_cfg.get("exact") or ()), tuple(exclude_cfg.get("regex") or ()))
+
+    def matches(self, text):
+        """True if text is excluded: a regex finds a match in it, or it equals an
+        exact entry (case-insensitive) as written or with its word order reversed."""
+        if self.exact:
+            lowered = text.lower()
+            if lowered in self.exact or reverse_word_order(lowered) in self.exact:
+                return True
+        return any(p.search(text) for p in self.patterns)
+
+
+@lru_cache(maxsize=8)
+def _compile(exact, regex):
+    return ExcludeRules(exact, regex)
@@ -0,0 +1,183 @@
+"""
+Niobium image handle — decode once, encode once.
+
+An in-memory image (a PDF figure or rendered page) is hashed for the cache,
+OCR'd, sent to Claude and uploaded to Anki or written into an .apkg.
+ImageHandle keeps the decoded pixels together with lazily computed,
+memoized encodings, so each of those steps reuses the same buffers instead
+of PNG-compressing the image again. Images taken straight from a PDF's
+compressed stream keep those bytes, which are hashed and uploaded as they
+are.
+"""
+
+import base64
+import hashlib
+import math
+import threading
+from io import BytesIO
+from PIL import Image, ImageChops, ImageStat
+
+# Encodings Anki's webview and PIL both handle, so they can be uploaded as stored
+WEB_FORMATS = {"png", "jpeg", "jpg", "gif", "webp"}
+
+# Claude bills an image at roughly one input token per this many pixels
+TOKEN_PIXELS = 750
+
+# Claude scales larger images down to this long edge and pixel count before reading them
+CLAUDE_MAX_EDGE = 1568
+CLAUDE_MAX_PIXELS = 1_150_000
+
+# Media types Claude accepts, by PIL format
+_MEDIA_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp", "GIF": "image/gif"}
+
+
+class ImageHandle:
+    """Decoded PIL image plus its PNG encoding and content hash, computed on first use.
+
+    data/ext optionally hold the image's original encoded bytes (e.g. a JPEG
+    stream from a PDF); they are then used for hashing and upload.
+    """
+
+    def __init__(self, image, data=None, ext=None):
+        self.image = image
+        self.data = data
+        self.ext = ext if data is not None else "png"
+        self._png = None
+        self._hash = None
+        # The OCR producer thread and the delivery thread may both ask for the PNG
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_bytes(cls, data, ext):
+        """Wrap encoded image bytes; pixels are decoded only when first needed."""
+        return cls(Image.open(BytesIO(data)), data, ext)
+
+    @classmethod
+    def from_png(cls, data):
+        """Wrap PNG bytes of an image that was encoded from pixels (e.g. a cached
+        page render); the bytes are reused as its PNG and it hashes by pixels
+        like the image it was made from."""
+        handle = cls(Image.open(BytesIO(data)))
+        handle._png = data
+        return handle
+
+    @property
+    def size(self):
+        return self.image.size
+
+    @property
+    def png(self):
+        """PNG bytes of the image."""
+        with self._lock:
+            if self._png is None:
+                with BytesIO() as output:
+                    self.image.save(output, format="PNG")
+                    self._png = output.getvalue()
+            return self._png
+
+    @property
+    def encoded(self):
+        """The original bytes when there are any, otherwise the PNG bytes (see ext)."""
+        return self.data if self.data is not None else self.png
+
+    @property
+    def b64(self):
+        """Base64 of the encoded bytes, for AnkiConnect uploads."""
+        return base64.b64encode(self.encoded).decode("utf-8")
+
+    @property
+    def content_hash(self):
+        """sha256 of the original bytes, or over mode, size and raw pixels; needs no encode."""
+        with self._lock:
+            if self._hash is None and self.data is not None:
+                self._hash = hashlib.sha256(self.data).hexdigest()
+            elif self._hash is None:
+                h = hashlib.sha256(f"{self.image.mode}:{self.image.width}x{self.image.height}:".encode("utf-8"))
+                h.update(self.image.tobytes())
+                self._hash = h.hexdigest()
+            return self._hash
+
+    def save_png(self, path):
+        """Write the PNG bytes to path."""
+        with open(path, "wb") as f:
+            f.write(self.png)
+
+    def save_encoded(self, path):
+        """Write the encoded bytes to path; the caller picks the extension from ext."""
+        with open(path, "wb") as f:
+            f.write(self.encoded)
+
+
+def as_handle(image):
+    """Wrap a PIL image in an ImageHandle; handles are returned as they are."""
+    if image is None or isinstance(image, ImageHandle):
+        return image
+    return ImageHandle(image)
+
+
+def estimate_image_tokens(width, height):
+    """Approximate Claude input tokens for a width x height image."""
+    return -(-width * height // TOKEN_PIXELS)
+
+
+def fit_size(width, height, max_edge=CLAUDE_MAX_EDGE, max_pixels=CLAUDE_MAX_PIXELS):
+    """width x height scaled down, keeping the aspect ratio, to at most max_edge and max_pixels."""
+    scale = min(1.0, max_edge / max(width, height), math.sqrt(max_pixels / (width * height)))
+    if scale >= 1.0:
+        return width, height
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _psnr(a, b):
+    """Peak signal-to-noise ratio (dB) between two images of the same size and mode."""
+    stat = ImageStat.Stat(ImageChops.difference(a, b))
+    mse = sum(rms ** 2 for rms in stat.rms) / len(stat.rms)
+    return float("inf") if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def encode_payload(data, max_edge=CLAUDE_MAX_EDGE, max_pixels=CLAUDE_MAX_PIXELS, quality=90, min_psnr=38.0,
+                   lossy=False):
+    """Re-encode image bytes compactly for a Claude request.
+
+    The image is scaled down (keeping its aspect ratio, so fractional
+    coordinates stay valid) to fit max_edge and max_pixels. With lossy
+    (meant for photos), JPEG and WebP at quality are tried first and kept
+    only when their PSNR against the pixels is at least min_psnr (None =
+    lossless only). PSNR does not tell text from photos, since rendered
+    text on a flat background passes easily, so rendered pages and crops
+    are sent without lossy. Otherwise the image is encoded as lossless PNG
+    and WebP. The smallest candidate wins; the original bytes count as one
+    when the image is not resized.
+
+    Returns (bytes, media_type, original_size, sent_size).
+    """
+    img = Image.open(BytesIO(data))
+    original_size = img.size
+    size = fit_size(*img.size, max_edge=max_edge, max_pixels=max_pixels)
+    candidates = []
+    if size == img.size and img.format in _MEDIA_TYPES:
+        candidates.append((data, _MEDIA_TYPES[img.format]))
+    has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+    img = img.convert("RGBA" if has_alpha else "RGB")
+    if size != img.size:
+        img = img.resize(size, Image.LANCZOS)
+
+    def _encode(fmt, **options):
+        with BytesIO() as output:
+            img.save(output, format=fmt, **options)
+            return output.getvalue(), _MEDIA_TYPES[fmt]
+
+    close = []
+    if lossy and min_psnr is not None:
+        encodings = [_encode("WEBP", quality=quality)]
+        if not has_alpha:
+            encodings.append(_encode("JPEG", quality=quality))
+        for encoded, media_type in encodings:
+            decoded = Image.open(BytesIO(encoded)).convert(img.mode)
+            if _psnr(img, decoded) >= min_psnr:
+                close.append((encoded, media_type))
+    # Lossless encodings of an image that compresses well lossily are far larger; skip them
+    candidates.extend(close or [_encode("PNG"), _encode("WEBP", lossless=True)])
+
+    encoded, media_type = min(candidates, key=lambda c: len(c[0]))
+    return encoded, media_type, original_size, size
@@ -1,7 +1,6 @@
 import requests
 import base64
 import numpy as np
-from easyocr import Reader
 from PIL import Image, ImageDraw
 from hashlib import blake2b
 import time
@@ -13,6 +12,10 @@ import re
 import fitz
 from tqdm import tqdm
 from io import BytesIO
+from itertools import islice, tee
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 from pathlib import Path
 from rich.console import Console
 from rich.prompt import Confirm
@@ -21,12 +24,38 @@ import random
 import genanki
 import pymupdf4llm
 
-from anki_niobium.cache import content_hash_file, content_hash_bytes, is_processed, mark_processed
+from anki_niobium.cache import (
+    content_hash_file, is_processed, mark_processed, get_cached_ocr, set_cached_ocr,
+    get_cached_page, set_cached_page,
+)
+from anki_niobium import merge, ocr
+from anki_niobium.exclude import ExcludeRules, reverse_word_order
+from anki_niobium.pdf import PdfSession, open_pdf
+from anki_niobium.image import TOKEN_PIXELS, WEB_FORMATS, ImageHandle, as_handle, estimate_image_tokens
+from anki_niobium.pipeline import Pipeline
 from anki_niobium.theme import S, ansi, set_theme
 
 ANKI_LOCAL = "http://localhost:8765"
 console = Console()
 
+# Default thresholds for telling decorative PDF images from figures (pdf.decorative)
+DECORATIVE_RULES = {"icon_size": 50, "strip_aspect": 5.0, "background_area": 0.8}
+
+# Share of a figure the bounding box of its text-layer words must span for
+# them to be used as its labels; sparser words (a title, a panel letter) over
+# a raster with labels of its own mean the figure is OCR'd instead
+TEXT_LAYER_COVERAGE = 0.25
+
+# Default adaptive render policy for pages sent to Claude (pdf.render)
+RENDER_POLICY = {"adaptive": True, "min_dpi": 72, "figure_edge": 1000, "max_edge": 1568, "max_tokens": 1600}
+
+# Bump when page analysis (classification, rendering, markdown) changes, so
+# cached pages from older releases are not reused
+PAGE_CACHE_VERSION = 3
+
+# Default figure-crop sending for smart generation (pdf.crops)
+CROP_POLICY = {"enabled": True, "padding": 0.02, "max_area": 0.5}
+
 CLOZE_MODEL = genanki.Model(
     1607392320,
     'Cloze',
@@ -66,16 +95,47 @@ class niobium:
 
         self.langs = self.args.get("langs") if self.args.get("langs") is not None else self.config.get("langs", "en")
         self.gpu = self.args.get("gpu") if self.args.get("gpu") is not None else self.config.get("gpu", -1)
+        ocr_cfg = self.config.get("ocr") or {}
+        self.reader_options = ocr_cfg.get("reader_options") or {}
+        self.ocr_batch_size = max(1, int(ocr_cfg.get("batch_size", 1)))
+        self.workers = max(1, self.args.get("workers") or 1)
+        self.ocr_cache = ocr_cfg.get("cache", True)
+        pipeline_cfg = self.config.get("pipeline") or {}
+        self.queue_size = pipeline_cfg.get("queue_size", 4)
+        self.filter_workers = max(1, pipeline_cfg.get("filter_workers", 1))
+        pdf_cfg = self.config.get("pdf") or {}
+        self.pdf_text_layer = pdf_cfg.get("text_layer", True)
+        self.pdf_dpi = pdf_cfg.get("dpi", 200)
+        self.pdf_lookahead = pdf_cfg.get("lookahead", 2)
+        self.pdf_markdown_window = pdf_cfg.get("markdown_window", 16)
+        self.pdf_raw_images = pdf_cfg.get("raw_images", True)
+        decorative_cfg = pdf_cfg.get("decorative") or {}
+        self.pdf_decorative = {k: decorative_cfg.get(k, v) for k, v in DECORATIVE_RULES.items()}
+        self.pdf_skip_decorative = decorative_cfg.get("skip", True)
+        self.pdf_render = {**RENDER_POLICY, **(pdf_cfg.get("render") or {})}
+        self.pdf_cache = pdf_cfg.get("cache", True)
+        self.pdf_crops = {**CROP_POLICY, **(pdf_cfg.get("crops") or {})}
+        self.ocr_prep = {
+            "max_edge": ocr_cfg.get("max_edge", 0) or 0,
+            "tile_aspect": ocr_cfg.get("tile_aspect", 0) or 0,
+            "tile_overlap": ocr_cfg.get("tile_overlap", 0.1),
+        }
         self.smart = self.args.get("smart", False)
         self.generate = self.args.get("generate", False)
         self.page = self.args.get("page")
+        # The input PDF is opened once and shared by every stage of the run
+        self.pdf = PdfSession(self.args["single_pdf"]) if self.args.get("single_pdf") else None
         self.card_type = self.args.get("card_type")
         self.qc = self.config.get("qc", False)
         self.no_cache = self.args.get("no_cache", False)
+        self.batch = self.args.get("batch", False)
+        # Collector of the --batch collect pass (see run_batched)
+        self._batch = None
 
         # max_cards: CLI flag overrides config
         llm_cfg = self.config.get("llm", {})
         self.max_cards = self.args.get("max_cards") if self.args.get("max_cards") is not None else llm_cfg.get("max_cards")
+        self.llm_concurrency = max(1, int(llm_cfg.get("concurrency", 4)))
 
         # Work directory for smart mode artifacts
         if self.smart:
@@ -92,6 +152,12 @@ class niobium:
         else:
             self.work_dir = None
 
+    def close(self):
+        """Close the run's PDF, if any."""
+        if self.pdf is not None:
+            self.pdf.close()
+            self.pdf = None
+
     def _derive_deck_name(self):
         """Derive a human-readable deck name from the input."""
         if self.args.get('single_pdf'):
@@ -431,7 +497,7 @@ class niobium:
         prefix = f"page_{tag.zfill(3)}"
         if page_img is not None:
             img_path = os.path.join(self.work_dir, f"{prefix}_render.png")
-            page_img.save(img_path)
+            as_handle(page_img).save_png(img_path)
         if page_text is not None:
             md_path = os.path.join(self.work_dir, f"{prefix}_text.md")
             with open(md_path, "w", encoding="utf-8") as f:
@@ -510,24 +576,24 @@ class niobium:
 
         if self.args['image'] != None:
             # Single image
-            results, H, W, image_bytes = self.ocr_single_image(self.args["image"], self.langs, self.gpu)
-            if self.merge_enabled:
-                results = self.merge_boxes(results, (self.merge_lim_x, self.merge_lim_y))
-            if self.smart:
-                from anki_niobium.llm import smart_filter_results
-                results, extra = smart_filter_results(results, image_bytes, {**self.config, "_no_cache": self.no_cache})
-            else:
-                results, extra = self.filter_results(results, self.config)
-            occlusion = self.get_occlusion_coords(results, H, W)
-            status = self.add_image_occlusion_deck(self.args["image"], occlusion, self.args["deck_name"], extra, None,self.args["add_header"])
-            console.print(status[1])
-            c_hash = content_hash_file(self.args["image"])
-            mark_processed(c_hash, self.args["image"])
-            if self.qc:
-                opdir = os.path.join(os.path.dirname(os.path.abspath(self.args["image"])), 'niobium-io')
-                if not os.path.exists(opdir):
-                    os.makedirs(opdir)
-                self.save_qc_image(results, self.args["image"], path=opdir, image_in=None)
+            ocr_out = self.ocr_single_image(
+                self.args["image"], self.langs, self.gpu,
+                reader_options=self.reader_options, use_cache=self.ocr_cache,
+                prep=self.ocr_prep, encode=self.smart,
+            )
+            filtered = self._filter_occlusions(ocr_out)
+            # None while --batch collects requests
+            if filtered is not None:
+                results, extra, occlusion = filtered
+                status = self.add_image_occlusion_deck(self.args["image"], occlusion, self.args["deck_name"], extra, None,self.args["add_header"])
+                console.print(status[1])
+                c_hash = content_hash_file(self.args["image"])
+                mark_processed(c_hash, self.args["image"])
+                if self.qc:
+                    opdir = os.path.join(os.path.dirname(os.path.abspath(self.args["image"])), 'niobium-io')
+                    if not os.path.exists(opdir):
+                        os.makedirs(opdir)
+                    self.save_qc_image(results, self.args["image"], path=opdir, image_in=None)
         elif self.args['directory'] != None:
             # Batch process
             console.print(f"[{S.accent}]Starting batch processing {self.args['directory']}[/{S.accent}]")
@@ -537,31 +603,28 @@ class niobium:
                 os.makedirs(opdir)
             img_list = self.get_images_in_directory(self.args['directory'])
             console.print(f"[{S.accent}]{len(img_list)} images found[/{S.accent}]")
-            it = 1
-            skipped = 0
+            pending = []
             for img_path in img_list:
-                console.print(f"[{S.muted}]\\[{it}/{len(img_list)}][/{S.muted}]")
                 c_hash = content_hash_file(img_path)
                 if not self.no_cache and is_processed(c_hash):
                     console.print(f"[{S.muted}]Skipping {os.path.basename(img_path)} (already processed)[/{S.muted}]")
-                    skipped += 1
-                    it += 1
                     continue
-                results, H, W, image_bytes = self.ocr_single_image(img_path, self.langs, self.gpu)
-                if self.merge_enabled:
-                    results = self.merge_boxes(results, (self.merge_lim_x, self.merge_lim_y))
-                if self.smart:
-                    from anki_niobium.llm import smart_filter_results
-                    results, extra = smart_filter_results(results, image_bytes, {**self.config, "_no_cache": self.no_cache})
-                else:
-                    results, extra = self.filter_results(results, self.config)
-                occlusion = self.get_occlusion_coords(results, H, W)
+                pending.append((img_path, c_hash))
+            skipped = len(img_list) - len(pending)
+            ocr_stream = self.ocr_images(
+                ((img_path, None) for img_path, _ in pending), self.langs, self.gpu,
+                batch_size=self.ocr_batch_size, reader_options=self.reader_options,
+                workers=self.workers, use_cache=self.ocr_cache,
+                prep=self.ocr_prep, encode=self.smart,
+            )
+            staged = self._filter_pipeline(zip(pending, ocr_stream))
+            for it, ((img_path, c_hash), (results, extra, occlusion)) in enumerate(staged, 1):
+                console.print(f"[{S.muted}]\\[{it}/{len(pending)}][/{S.muted}]")
                 status = self.add_image_occlusion_deck(img_path, occlusion, self.args["deck_name"], extra, None,self.args["add_header"])
                 console.print(status[1])
                 mark_processed(c_hash, img_path)
                 if self.qc:
                     self.save_qc_image(results, img_path, path=opdir, image_in=None)
-                it += 1
             if skipped:
                 console.print(f"[{S.muted}]{skipped} image(s) skipped (already in cache)[/{S.muted}]")
         elif self.args['single_pdf'] != None:
@@ -571,40 +634,153 @@ class niobium:
             if not os.path.exists(opdir):
                 os.makedirs(opdir)
             console.print(f"[{S.accent}]Preview images will be saved at {opdir}[/{S.accent}]")
-            doc = fitz.Document(self.args['single_pdf'])
-            page_set = niobium.parse_page_range(self.page, doc.page_count, doc=doc) if self.page else None
-            doc.close()
-            all_images = self.extract_images_from_pdf(self.args['single_pdf'], pages=page_set)
-            console.print(f"[{S.accent}]{len(all_images)} images were extracted from the PDF.[/{S.accent}]")
-            it = 1
+            page_set = niobium.parse_page_range(self.page, self.pdf.page_count, doc=self.pdf) if self.page else None
+            sources = self.extract_occlusion_sources(
+                self.pdf, pages=page_set, text_layer=self.pdf_text_layer, dpi=self.pdf_dpi,
+                raw=self.pdf_raw_images, decorative=self.pdf_decorative if self.pdf_skip_decorative else None,
+            )
             skipped = 0
-            for im in all_images:
-                console.print(f"[{S.muted}]\\[{it}/{len(all_images)}][/{S.muted}]")
-                im_bytes = niobium.byte_convert(im)
-                c_hash = content_hash_bytes(im_bytes)
-                if not self.no_cache and is_processed(c_hash):
-                    console.print(f"[{S.muted}]Skipping PDF image {it} (already processed)[/{S.muted}]")
-                    skipped += 1
-                    it += 1
-                    continue
-                results, H, W, image_bytes = self.ocr_single_image(None, self.langs, self.gpu, im)
-                if self.merge_enabled:
-                    results = self.merge_boxes(results, (self.merge_lim_x, self.merge_lim_y))
-                if self.smart:
-                    from anki_niobium.llm import smart_filter_results
-                    results, extra = smart_filter_results(results, image_bytes, {**self.config, "_no_cache": self.no_cache})
-                else:
-                    results, extra = self.filter_results(results, self.config)
-                occlusion = self.get_occlusion_coords(results, H, W)
+
+            def _unprocessed():
+                # Images stream in from the PDF; nothing is held beyond the OCR batch and pipeline queues
+                nonlocal skipped
+                for it, (im, known) in enumerate(sources, 1):
+                    c_hash = im.content_hash
+                    if not self.no_cache and is_processed(c_hash):
+                        console.print(f"[{S.muted}]Skipping PDF image {it} (already processed)[/{S.muted}]")
+                        skipped += 1
+                        continue
+                    yield (im, known, c_hash)
+
+            pending, feed = tee(_unprocessed())
+            ocr_stream = self.ocr_images(
+                ((None, im, known) for im, known, _ in feed), self.langs, self.gpu,
+                batch_size=self.ocr_batch_size, reader_options=self.reader_options,
+                workers=self.workers, use_cache=self.ocr_cache,
+                prep=self.ocr_prep, encode=self.smart,
+            )
+            staged = self._filter_pipeline(zip(pending, ocr_stream))
+            for it, ((im, _, c_hash), (results, extra, occlusion)) in enumerate(staged, 1):
+                console.print(f"[{S.muted}]\\[{it}][/{S.muted}]")
                 status = self.add_image_occlusion_deck(None, occlusion, self.args["deck_name"], extra, im,self.args["add_header"])
                 console.print(status[1])
                 mark_processed(c_hash, f"pdf:{os.path.basename(self.args['single_pdf'])}")
                 if self.qc:
-                    self.save_qc_image(results, None, path=opdir, image_in=im)
-                it += 1
+                    self.save_qc_image(results, None, path=opdir, image_in=im.image)
             if skipped:
                 console.print(f"[{S.muted}]{skipped} image(s) skipped (already in cache)[/{S.muted}]")
 
+        ocr.print_timing_summary()
+        ocr.release()
+
+    def _filter_occlusions(self, ocr_out):
+        """Merge and filter one OCR result. Returns (results, extra, occlusion).
+
+        Returns None during a --batch collect pass (see run_batched).
+        """
+        results, H, W, image_bytes = ocr_out
+        if self.merge_enabled:
+            results = self.merge_boxes(results, (self.merge_lim_x, self.merge_lim_y))
+        if self.smart:
+            from anki_niobium.llm import smart_filter_results
+            filtered = smart_filter_results(results, image_bytes, self._llm_config())
+            if filtered is None:
+                return None
+            results, extra = filtered
+        else:
+            results, extra = self.filter_results(results, self.config)
+        return results, extra, self.get_occlusion_coords(results, H, W)
+
+    def _filter_pipeline(self, items):
+        """Overlap OCR, filtering and delivery for (meta, ocr_out) items.
+
+        The items iterable (decode + OCR) is drained by a producer thread, the
+        merge/filter stage (Claude calls with --smart) runs on
+        pipeline.filter_workers threads, and (meta, (results, extra, occlusion))
+        pairs come back in input order for the caller to deliver. During a
+        --batch collect pass no item comes back.
+        """
+        stage = lambda item: (item[0], self._filter_occlusions(item[1]))
+        staged = Pipeline([("filter", stage, self.filter_workers)], queue_size=self.queue_size).run(items)
+        return (item for item in staged if item[1] is not None)
+
+    def _llm_config(self):
+        """Config passed to the llm module: Claude cache use, the --batch collector and
+        whether occlusion images are image files (which may be sent lossy) or PDF figures."""
+        return {**self.config, "_no_cache": self.no_cache, "_batch": self._batch,
+                "_photo_input": not self.args.get("single_pdf")}
+
+    def run_batched(self, run):
+        """Run a smart-mode command with its Claude requests sent as one Message Batch.
+
+        run is called twice. The first pass delivers nothing and collects
+        every request that is not in the Claude cache; they are submitted as
+        one batch (or the batch of an interrupted run is resumed) and the
+        results are cached as it ends. The second pass is a normal run that
+        reads them from the cache; requests that failed in the batch are
+        sent individually. The OCR and page caches are on for both passes,
+        so the second one reuses the first one's OCR and page renders.
+        """
+        from anki_niobium.batch import BatchCollector
+        collector = BatchCollector(self.config)
+        if not (self.ocr_cache and self.pdf_cache):
+            console.print(f"[{S.muted}]--batch: using the OCR and page caches so the second pass does not redo the first[/{S.muted}]")
+            self.ocr_cache = self.pdf_cache = True
+        console.print(f"[{S.accent}]Collecting Claude requests for a Message Batch[/{S.accent}]")
+        self._batch = collector
+        try:
+            run()
+        finally:
+            self._batch = None
+        if not collector.requests:
+            console.print(f"[{S.muted}]All Claude responses are cached; nothing to submit[/{S.muted}]")
+        else:
+            collector.run()
+        run()
+
+    def _figure_crops(self, img, text, figures):
+        """Figure crops to send instead of the full page render, or None to send the page.
+
+        Figure regions are padded by pdf.crops.padding (a share of the page
+        size) and overlapping ones are merged. The page is sent whole when
+        crops are disabled, when there is no page text to go with them, or
+        when the crops would cover more than pdf.crops.max_area of the page.
+        Returns a list of (png_bytes, (left, top, width, height)) with the
+        region as fractions of the page image.
+        """
+        crops = self.pdf_crops
+        if not crops.get("enabled") or img is None or not figures or not (text or "").strip():
+            return None
+        pad = crops.get("padding", 0)
+        boxes = [
+            [max(0.0, l - pad), max(0.0, t - pad), min(1.0, l + w + pad), min(1.0, t + h + pad)]
+            for l, t, w, h in figures
+        ]
+        # Merge overlapping boxes until none overlap
+        merged = True
+        while merged:
+            merged = False
+            for a in range(len(boxes)):
+                for b in range(a + 1, len(boxes)):
+                    p, q = boxes[a], boxes[b]
+                    if p[0] < q[2] and q[0] < p[2] and p[1] < q[3] and q[1] < p[3]:
+                        boxes[a] = [min(p[0], q[0]), min(p[1], q[1]), max(p[2], q[2]), max(p[3], q[3])]
+                        del boxes[b]
+                        merged = True
+                        break
+                if merged:
+                    break
+        if sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in boxes) > crops.get("max_area", 1.0):
+            return None
+        W, H = img.size
+        result = []
+        for x0, y0, x1, y1 in sorted(boxes, key=lambda b: (b[1], b[0])):
+            # Snap to whole pixels so the region matches the crop exactly
+            px = (int(x0 * W), int(y0 * H), max(int(x0 * W) + 1, round(x1 * W)), max(int(y0 * H) + 1, round(y1 * H)))
+            region = (px[0] / W, px[1] / H, (px[2] - px[0]) / W, (px[3] - px[1]) / H)
+            result.append((ImageHandle(img.image.crop(px)).png, region))
+        return result
+
     @staticmethod
     def _validate_and_fix_card(card, has_image):
         """
@@ -717,7 +893,7 @@ class niobium:
                 elif deck:
                     hashed_name = niobium.get_image_hash() + '.png'
                     tmp_path = os.path.join(tmp_media_dir, hashed_name)
-                    page_image.save(tmp_path, format='PNG')
+                    as_handle(page_image).save_png(tmp_path)
                     media_files.append(tmp_path)
                     IO_MODEL = genanki.Model(
                         1607392319, 'Image Occlusion',
@@ -777,51 +953,102 @@ class niobium:
         return created
 
     def _collect_generate_items(self):
-        """Collect items for the generation pipeline.
+        """Yield items for the generation pipeline, one at a time.
 
-        Returns list of (label, idx, display_name, img_or_None, text_or_None, content_hash, source) tuples.
+        Yields (label, idx, display_name, img_or_None, text_or_None, content_hash, source, figures) tuples.
         display_name is the user-visible page label (for artifact naming).
-        Works for both PDF pages and image inputs.
+        figures lists the page regions of a PDF page's figures (see
+        _classify_page_images); it is empty for image inputs. For PDF pages
+        content_hash is the page fingerprint (see PdfSession.page_fingerprint).
+        Works for both PDF pages and image inputs. PDF pages are rendered
+        lazily, pdf.lookahead pages ahead of the caller.
         """
-        items = []
-
         if self.args.get('single_pdf'):
-            pdf_path = self.args['single_pdf']
-            doc = fitz.Document(pdf_path)
-            page_set = niobium.parse_page_range(self.page, doc.page_count, doc=doc)
-            doc.close()
-
-            rendered_pages = niobium.render_pdf_pages(pdf_path, pages=page_set)
-            n_img = sum(1 for _, img, _, _ in rendered_pages if img is not None)
-            n_txt = len(rendered_pages) - n_img
-            console.print(f"[{S.accent}]{len(rendered_pages)} page(s) analyzed ({n_img} with images, {n_txt} text-only).[/{S.accent}]")
-
-            for page_idx, page_img, page_text, page_label in rendered_pages:
-                label = f"Page {page_label}"
-                if page_img is not None:
-                    c_hash = content_hash_bytes(niobium.byte_convert(page_img))
-                else:
-                    c_hash = content_hash_bytes(page_text.encode("utf-8"))
+            pdf_path = self.pdf.path
+            page_set = niobium.parse_page_range(self.page, self.pdf.page_count, doc=self.pdf)
+            page_indices = sorted(page_set) if page_set else range(self.pdf.page_count)
+            # Read up front: the document is busy rendering while items are yielded
+            fingerprints = {i: self.pdf.page_fingerprint(i) for i in page_indices}
+            labels = self.pdf.labels
+
+            # Pages are identified by their fingerprint, so pages already turned
+            # into cards (also in an earlier version of the PDF) are skipped
+            # before they are rendered; they come through as items without content
+            done = []
+            if not self.no_cache:
+                done = [i for i in page_indices if is_processed(fingerprints[i])]
+            skip = set(done)
+            todo = [i for i in page_indices if i not in skip]
+            console.print(f"[{S.accent}]Analyzing {len(todo)} page(s).[/{S.accent}]")
+            if done:
+                console.print(f"[{S.muted}]{len(done)} unchanged page(s) already processed, not rendered again[/{S.muted}]")
+
+            def _item(page_idx, page_img=None, page_text=None, figures=()):
+                page_label = labels[page_idx]
                 source = f"pdf_page:{os.path.basename(pdf_path)}:p{page_label}"
-                items.append((label, page_idx, page_label, page_img, page_text, c_hash, source))
+                return (f"Page {page_label}", page_idx, page_label, page_img, page_text,
+                        fingerprints[page_idx], source, list(figures))
+
+            rendered_pages = niobium.render_pdf_pages(
+                self.pdf, pages=todo, lookahead=self.pdf_lookahead, workers=self.workers,
+                markdown_window=self.pdf_markdown_window, decorative=self.pdf_decorative,
+                dpi=self.pdf_dpi, render=self.pdf_render, use_cache=self.pdf_cache,
+            ) if todo else ()
+            done = deque(done)
+            for page_idx, page_img, page_text, page_label, figures in rendered_pages:
+                while done and done[0] < page_idx:
+                    yield _item(done.popleft())
+                yield _item(page_idx, page_img, page_text, figures)
+            while done:
+                yield _item(done.popleft())
 
         elif self.args.get('image'):
             img_path = self.args['image']
-            img = Image.open(img_path)
+            img = ImageHandle(Image.open(img_path))
             label = os.path.basename(img_path)
             c_hash = content_hash_file(img_path)
-            items.append((label, 0, None, img, None, c_hash, img_path))
+            yield (label, 0, None, img, None, c_hash, img_path, [])
 
         elif self.args.get('directory'):
             img_list = self.get_images_in_directory(self.args['directory'])
             console.print(f"[{S.accent}]{len(img_list)} images found.[/{S.accent}]")
             for idx, img_path in enumerate(img_list):
-                img = Image.open(img_path)
+                img = ImageHandle(Image.open(img_path))
                 label = os.path.basename(img_path)
                 c_hash = content_hash_file(img_path)
-                items.append((label, idx, None, img, None, c_hash, img_path))
+                yield (label, idx, None, img, None, c_hash, img_path, [])
+
+    def _generate_cards(self, items):
+        """Run smart_generate_cards over generation items, llm.concurrency calls at a time.
+
+        Yields (item, cached_info, card_data) in item order, so cards are
+        delivered, saved and marked processed in page order from the calling
+        thread. Items already processed come back with their cached_info and
+        no card_data, without calling Claude. Claude's per-page output is
+        printed as each request finishes.
+        """
+        from anki_niobium.llm import smart_generate_cards
+        config = self._llm_config()
 
-        return items
+        def _generate(item):
+            label, idx, display_name, img, text, c_hash, source, figures = item
+            if not self.no_cache:
+                cached_info = is_processed(c_hash)
+                if cached_info:
+                    return item, cached_info, None
+            page_bytes = img.png if img is not None else None
+            card_data = smart_generate_cards(
+                idx, page_bytes, config,
+                max_cards=self.max_cards, card_type=self.card_type, page_text=text,
+                page_label=display_name, figure_crops=self._figure_crops(img, text, figures),
+            )
+            return item, None, card_data
+
+        if self.llm_concurrency > 1:
+            console.print(f"[{S.muted}]Up to {self.llm_concurrency} Claude requests in flight[/{S.muted}]")
+        return Pipeline(
+            [("claude", _generate, self.llm_concurrency)], queue_size=self.queue_size,
+        ).run(items)
 
     def smart_generate_to_deck(self):
         """Smart generation pipeline → push to Anki via AnkiConnect."""
@@ -834,28 +1061,25 @@ class niobium:
             else:
                 raise Exception('Cannot create notes without a deck. Terminating ...')
 
-        from anki_niobium.llm import smart_generate_cards
         items = self._collect_generate_items()
 
         total_cards = 0
         skipped = 0
-        for label, idx, display_name, img, text, c_hash, source in items:
+        n_items = 0
+        for item, cached_info, card_data in self._generate_cards(items):
+            label, idx, display_name, img, text, c_hash, source, figures = item
+            n_items += 1
             console.print(f"[{S.muted}]\\[{label}][/{S.muted}]")
             self.save_work_artifact(idx, page_img=img, page_text=text, display_name=display_name)
 
-            if not self.no_cache:
-                cached_info = is_processed(c_hash)
-                if cached_info:
-                    niobium._show_cache_hit(label, cached_info)
-                    skipped += 1
-                    continue
+            if cached_info:
+                niobium._show_cache_hit(label, cached_info)
+                skipped += 1
+                continue
+            if card_data is None:
+                # Queued for the --batch request
+                continue
 
-            page_bytes = niobium.byte_convert(img) if img is not None else None
-            card_data = smart_generate_cards(
-                idx, page_bytes, {**self.config, "_no_cache": self.no_cache},
-                max_cards=self.max_cards, card_type=self.card_type, page_text=text,
-                page_label=display_name,
-            )
             self.save_work_artifact(idx, card_data=card_data, display_name=display_name)
             n = self.deliver_generated_cards(card_data, img, idx, deck_name=deck_name)
             total_cards += n
@@ -863,7 +1087,7 @@ class niobium:
 
         if skipped:
             console.print(f"[{S.muted}]{skipped} item(s) skipped (already in cache)[/{S.muted}]")
-        console.print(f"[bold {S.success}]{total_cards} cards created from {len(items)} item(s).[/bold {S.success}]")
+        console.print(f"[bold {S.success}]{total_cards} cards created from {n_items} item(s).[/bold {S.success}]")
         if self.work_dir:
             console.print(f"[{S.accent}]Artifacts: {self.work_dir}[/{S.accent}]")
 
@@ -878,28 +1102,25 @@ class niobium:
         tmp_media_dir = os.path.join(out_dir, f"nb41_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
         os.makedirs(tmp_media_dir, exist_ok=True)
 
-        from anki_niobium.llm import smart_generate_cards
         items = self._collect_generate_items()
 
         total_cards = 0
         skipped = 0
-        for label, idx, display_name, img, text, c_hash, source in items:
+        processed = []
+        for item, cached_info, card_data in self._generate_cards(items):
+            label, idx, display_name, img, text, c_hash, source, figures = item
+            processed.append((c_hash, source))
             console.print(f"[{S.muted}]\\[{label}][/{S.muted}]")
             self.save_work_artifact(idx, page_img=img, page_text=text, display_name=display_name)
 
-            if not self.no_cache:
-                cached_info = is_processed(c_hash)
-                if cached_info:
-                    niobium._show_cache_hit(label, cached_info)
-                    skipped += 1
-                    continue
+            if cached_info:
+                niobium._show_cache_hit(label, cached_info)
+                skipped += 1
+                continue
+            if card_data is None:
+                # Queued for the --batch request
+                continue
 
-            page_bytes = niobium.byte_convert(img) if img is not None else None
-            card_data = smart_generate_cards(
-                idx, page_bytes, {**self.config, "_no_cache": self.no_cache},
-                max_cards=self.max_cards, card_type=self.card_type, page_text=text,
-                page_label=display_name,
-            )
             self.save_work_artifact(idx, card_data=card_data, display_name=display_name)
             n = self.deliver_generated_cards(
                 card_data, img, idx,
@@ -907,15 +1128,20 @@ class niobium:
             )
             total_cards += n
 
+        import shutil
+        if self._batch is not None:
+            # --batch collect pass: the package is written by the second pass
+            shutil.rmtree(tmp_media_dir)
+            return
+
         apkg_path = os.path.join(out_dir, f'{self._derive_output_stem()}.apkg')
         pkg = genanki.Package(deck)
         pkg.media_files = media_files
         pkg.write_to_file(apkg_path)
-        import shutil
         shutil.rmtree(tmp_media_dir)
 
         # Record paths for all processed items
-        for label, idx, display_name, img, text, c_hash, source in items:
+        for c_hash, source in processed:
             mark_processed(c_hash, source, output_path=apkg_path, artifacts_path=self.work_dir)
 
         if skipped:
@@ -952,37 +1178,26 @@ class niobium:
         deck = genanki.Deck(random.randrange(1 << 30, 1 << 31), deck_name)
         media_files = []
 
-        def process_image(image_name, image_in=None, is_batch=False):
-            # Cache check: skip in batch context
+        def image_hash(image_name, image_in=None):
             if image_name:
-                c_hash = content_hash_file(image_name)
-            else:
-                c_hash = content_hash_bytes(niobium.byte_convert(image_in))
-            if is_batch and not self.no_cache and is_processed(c_hash):
-                console.print(f'[{S.muted}]Skipping (already processed)[/{S.muted}]')
-                return True  # skipped
-
-            results, H, W, image_bytes = self.ocr_single_image(image_name, self.langs, self.gpu, image_in)
-            if self.merge_enabled:
-                results = self.merge_boxes(results, (self.merge_lim_x, self.merge_lim_y))
-            if self.smart:
-                from anki_niobium.llm import smart_filter_results
-                results, extra = smart_filter_results(results, image_bytes, {**self.config, "_no_cache": self.no_cache})
-            else:
-                results, extra = self.filter_results(results, self.config)
+                return content_hash_file(image_name)
+            return image_in.content_hash
+
+        def process_image(image_name, image_in, c_hash, filtered):
+            if filtered is None:
+                return False
+            results, extra, occlusion = filtered
             if not results:
                 console.print(f'[{S.accent2}]No occlusions found, skipping.[/{S.accent2}]')
                 return False
-            occlusion = self.get_occlusion_coords(results, H, W)
 
             # Prepare image file for media
-            hashed_name = niobium.get_image_hash(image_name) + '.png'
+            hashed_name = niobium.get_image_hash(image_name) + '.' + (image_in.ext if image_in else 'png')
+            tmp_path = os.path.join(tmp_media_dir, hashed_name)
             if image_name:
-                img = Image.open(image_name)
+                Image.open(image_name).save(tmp_path, format='PNG')
             else:
-                img = image_in
-            tmp_path = os.path.join(tmp_media_dir, hashed_name)
-            img.save(tmp_path, format='PNG')
+                image_in.save_encoded(tmp_path)
             media_files.append(tmp_path)
 
             header = ''
@@ -997,7 +1212,37 @@ class niobium:
             deck.add_note(note)
             console.print(f'[{S.success}]Note created with {len(results)} occlusions.[/{S.success}]')
             mark_processed(c_hash, image_name or f"pdf:{os.path.basename(self.args.get('single_pdf', 'unknown'))}")
-            return False
+
+        def process_batch(sources, total=None):
+            """OCR (image_name, image_in, results) sources in batches, skipping cached ones. Returns the skip count.
+
+            results is None unless the source already has text boxes (PDF text
+            layer). sources may be a lazy iterable; total is only for progress.
+            """
+            skipped = 0
+
+            def _unprocessed():
+                nonlocal skipped
+                for image_name, image_in, known in sources:
+                    c_hash = image_hash(image_name, image_in)
+                    if not self.no_cache and is_processed(c_hash):
+                        console.print(f'[{S.muted}]Skipping (already processed)[/{S.muted}]')
+                        skipped += 1
+                        continue
+                    yield (image_name, image_in, known, c_hash)
+
+            pending, feed = tee(_unprocessed())
+            ocr_stream = self.ocr_images(
+                ((image_name, image_in, known) for image_name, image_in, known, _ in feed), self.langs, self.gpu,
+                batch_size=self.ocr_batch_size, reader_options=self.reader_options,
+                workers=self.workers, use_cache=self.ocr_cache,
+                prep=self.ocr_prep, encode=self.smart,
+            )
+            staged = self._filter_pipeline(zip(pending, ocr_stream))
+            for i, ((image_name, image_in, _, c_hash), filtered) in enumerate(staged, 1):
+                console.print(f'[{S.muted}]\\[{i}{f"/{total - skipped}" if total else ""}][/{S.muted}]')
+                process_image(image_name, image_in, c_hash, filtered)
+            return skipped
 
         out_dir = self.args['apkg_out']
         os.makedirs(out_dir, exist_ok=True)
@@ -1005,71 +1250,53 @@ class niobium:
         os.makedirs(tmp_media_dir, exist_ok=True)
 
         if self.args.get('image'):
-            process_image(self.args['image'])
+            img_path = self.args['image']
+            ocr_out = self.ocr_single_image(
+                img_path, self.langs, self.gpu,
+                reader_options=self.reader_options, use_cache=self.ocr_cache,
+                prep=self.ocr_prep, encode=self.smart,
+            )
+            process_image(img_path, None, image_hash(img_path), self._filter_occlusions(ocr_out))
         elif self.args.get('directory'):
             img_list = self.get_images_in_directory(self.args['directory'])
             console.print(f'[{S.accent}]{len(img_list)} images found.[/{S.accent}]')
-            skipped = 0
-            for i, img_path in enumerate(img_list, 1):
-                console.print(f'[{S.muted}]\\[{i}/{len(img_list)}][/{S.muted}]')
-                if process_image(img_path, is_batch=True):
-                    skipped += 1
+            skipped = process_batch([(img_path, None, None) for img_path in img_list], total=len(img_list))
             if skipped:
                 console.print(f"[{S.muted}]{skipped} image(s) skipped (already in cache)[/{S.muted}]")
         elif self.args.get('single_pdf'):
-            doc = fitz.Document(self.args['single_pdf'])
-            page_set = niobium.parse_page_range(self.page, doc.page_count, doc=doc) if self.page else None
-            doc.close()
-            all_images = self.extract_images_from_pdf(self.args['single_pdf'], pages=page_set)
-            console.print(f'[{S.accent}]{len(all_images)} images extracted from PDF.[/{S.accent}]')
-            skipped = 0
-            for i, im in enumerate(all_images, 1):
-                console.print(f'[{S.muted}]\\[{i}/{len(all_images)}][/{S.muted}]')
-                if process_image(None, image_in=im, is_batch=True):
-                    skipped += 1
+            page_set = niobium.parse_page_range(self.page, self.pdf.page_count, doc=self.pdf) if self.page else None
+            sources = self.extract_occlusion_sources(
+                self.pdf, pages=page_set, text_layer=self.pdf_text_layer, dpi=self.pdf_dpi,
+                raw=self.pdf_raw_images, decorative=self.pdf_decorative if self.pdf_skip_decorative else None,
+            )
+            skipped = process_batch((None, im, known) for im, known in sources)
             if skipped:
                 console.print(f"[{S.muted}]{skipped} image(s) skipped (already in cache)[/{S.muted}]")
 
+        import shutil
+        if self._batch is not None:
+            # --batch collect pass: the package is written by the second pass
+            shutil.rmtree(tmp_media_dir)
+            return
+
         apkg_path = os.path.join(out_dir, f'{self._derive_output_stem()}.apkg')
         pkg = genanki.Package(deck)
         pkg.media_files = media_files
         pkg.write_to_file(apkg_path)
-        import shutil
         shutil.rmtree(tmp_media_dir)
         console.print(f'[bold {S.success}]Saved {apkg_path} ({len(deck.notes)} notes)[/bold {S.success}]')
+        ocr.print_timing_summary()
+        ocr.release()
 
-    @staticmethod
-    def reverse_word_order(string):
-        # Split the string into words
-        words = string.split()
-        
-        # Reverse the order of the words
-        reversed_words = words[::-1]
-        
-        # Join the reversed words back into a string
-        reversed_string = ' '.join(reversed_words)
-        
-        return reversed_string
+    reverse_word_order = staticmethod(reverse_word_order)
 
     @staticmethod
     def filter_results(results, config):
+        rules = ExcludeRules.from_config(config.get('exclude'))
         filtered_results = []
         extra = ''
         for (bbox, text, prob) in results:
-            cur_reg_flag = False
-            if config['exclude']['regex']:
-                for rgx in config['exclude']['regex']:
-                    matches = re.search(rgx, text)
-                    if matches:
-                        cur_reg_flag = True
-                        break
-            cur_exact_flag = False
-            if config['exclude']['exact']:
-                for cur_no in config['exclude']['exact']:
-                    if (cur_no.lower() == text.lower()) or (cur_no.lower() == niobium.reverse_word_order(text.lower())):
-                        cur_exact_flag = True
-                        break
-            if cur_exact_flag or cur_reg_flag:
+            if rules.matches(text):
                 console.print(f'[{S.muted}]Discarding occlusion with text {text}[/{S.muted}]')
             else:
                 filtered_results.append((bbox, text, prob))
@@ -1089,7 +1316,7 @@ class niobium:
     def parse_page_range(page_str, total_pages, doc=None):
         """Parse a page string (e.g. '5' or '5-10') into a set of 0-based page indices.
 
-        When a fitz.Document is provided, page labels are used for resolution so
+        When a fitz.Document or PdfSession is provided, page labels are used for resolution so
         that the user-visible page number in their PDF viewer maps to the correct
         physical page — even when the PDF has front matter that shifts numbering.
         """
@@ -1125,6 +1352,8 @@ class niobium:
             image = Image.open(image_name)
         else:
             image = image_in
+        # Draw on an RGB copy: leaves a shared in-memory image untouched and handles palette/gray images
+        image = image.convert('RGB')
         draw = ImageDraw.Draw(image)
         for (bbox, text, prob) in results:
             (tl, tr, br, bl) = bbox
@@ -1134,7 +1363,6 @@ class niobium:
             bl = (int(bl[0]), int(bl[1]))
             draw.rectangle([tl, br], outline="red", width=2)
         hashed_name = niobium.get_image_hash(image_name) + '.jpeg'
-        image = image.convert('RGB')
         image.save(os.path.join(path, hashed_name), quality=50)
 
     @staticmethod
@@ -1150,21 +1378,98 @@ class niobium:
         return lst
 
     @staticmethod
-    def ocr_single_image(image_name, langs, gpu, image_in=None):
-        if image_name:
-            image = Image.open(image_name)
-            W, H = image.size
-            image = niobium.byte_convert(image)
-            console.print(f"[{S.accent}]Running OCR for {image_name}[/{S.accent}]")
-        else:
-            image = image_in
-            W, H = image.size
-            image = niobium.byte_convert(image)
-            console.print(f"[{S.accent}]Running OCR for PDF image[/{S.accent}]")
-        langs = langs.split(",")
-        reader = Reader(langs, gpu=gpu > 0, verbose=False)
-        results = reader.readtext(image)
-        return (results, H, W, image)
+    def ocr_single_image(image_name, langs, gpu, image_in=None, reader_options=None, use_cache=True,
+                         prep=None, encode=True):
+        return next(niobium.ocr_images([(image_name, image_in)], langs, gpu, reader_options=reader_options,
+                                       use_cache=use_cache, prep=prep, encode=encode))
+
+    @staticmethod
+    def ocr_images(sources, langs, gpu, batch_size=1, reader_options=None, workers=1, use_cache=True,
+                   prep=None, encode=True):
+        """OCR (image_name, image_in[, results]) sources, batch_size images per model call.
+
+        Yields (results, H, W, image_bytes) per source in input order, the
+        same tuple ocr_single_image returns. Sources are consumed lazily, so
+        only one batch of decoded images is held in memory at a time.
+
+        prep holds the pre-OCR settings (max_edge, tile_aspect, tile_overlap):
+        large images are shrunk and very long captures split into overlapping
+        tiles, and boxes are mapped back to the original H/W. JPEG files are
+        decoded directly at reduced size when they will be shrunk.
+
+        Raw OCR output is cached per image content, languages, reader options
+        and prep settings, so re-tuning merge/exclude never re-runs the model.
+        image_in may be a PIL image or an ImageHandle; in-memory images are
+        hashed from their pixels and OCR'd from the decoded buffer, never
+        PNG-encoded for either. image_bytes (PNG, for smart filtering) is
+        None when encode is False; for handles it is the memoized encoding
+        that delivery reuses. Sources that already carry results (e.g. from
+        the PDF text layer) skip OCR and are passed through in order.
+        """
+        prep = prep or {}
+        cache_options = {**(reader_options or {}), "_prep": prep}
+
+        def _chunks():
+            it = iter(sources)
+            while True:
+                chunk = list(islice(it, batch_size))
+                if not chunk:
+                    return
+                entries = []
+                arrays = []
+                misses = 0
+                for source in chunk:
+                    image_name, image_in = source[:2]
+                    known = source[2] if len(source) > 2 else None
+                    handle = ImageHandle(Image.open(image_name)) if image_name else as_handle(image_in)
+                    image = handle.image
+                    W, H = image.size
+                    if known is not None:
+                        entries.append((W, H, handle.png if encode else None, None, known, None))
+                        continue
+                    if image_name:
+                        image_bytes = None
+                        image_hash = content_hash_file(image_name)
+                    else:
+                        image_bytes = handle.png if encode else None
+                        image_hash = handle.content_hash
+                    cached = get_cached_ocr(image_hash, langs, cache_options) if use_cache else None
+                    label = image_name if image_name else 'PDF image'
+                    transforms = None
+                    if cached is not None:
+                        console.print(f"[{S.muted}]Using cached OCR for {label}[/{S.muted}]")
+                    else:
+                        scale, tiles = ocr.plan_views(W, H, **prep)
+                        ocr_image = image
+                        if image_name:
+                            # Draft a copy: the handle's pixels are still PNG-encoded for Claude
+                            ocr_image = Image.open(image_name)
+                            ocr.draft(ocr_image, W, H, scale)
+                        views, transforms = ocr.render_views(ocr_image, W, H, scale, tiles)
+                        arrays.extend(views)
+                        misses += 1
+                    if image_name and encode:
+                        image_bytes = handle.png
+                    entries.append((W, H, image_bytes, image_hash, cached, transforms))
+                if misses == 1 and len(chunk) == 1:
+                    console.print(f"[{S.accent}]Running OCR for {label}[/{S.accent}]")
+                elif misses:
+                    console.print(f"[{S.accent}]Running OCR for a batch of {misses} images[/{S.accent}]")
+                yield entries, arrays
+
+        stream = ocr.readtext_stream(_chunks(), langs, gpu, reader_options, batch_size=batch_size, workers=workers)
+        for entries, view_results in stream:
+            offset = 0
+            for W, H, image_bytes, image_hash, cached, transforms in entries:
+                if cached is None:
+                    n = len(transforms)
+                    results = ocr.map_results(view_results[offset:offset + n], transforms, H >= W)
+                    offset += n
+                    if use_cache:
+                        set_cached_ocr(image_hash, langs, cache_options, results)
+                else:
+                    results = cached
+                yield (results, H, W, image_bytes)
 
     @staticmethod
     def add_image_occlusion_deck(image_name, occlusion, deck_name, extra, image_in,header=False):
@@ -1173,9 +1478,10 @@ class niobium:
                 image_data = f.read()
                 image_base64 = base64.b64encode(image_data).decode("utf-8")
         else:
-            image_in = niobium.byte_convert(image_in)
-            image_base64 = base64.b64encode(image_in).decode("utf-8")
-        hashed_name = "_" + niobium.get_image_hash(image_name) + '.jpeg'
+            image_in = as_handle(image_in)
+            image_base64 = image_in.b64
+        ext = 'jpeg' if image_name else image_in.ext
+        hashed_name = "_" + niobium.get_image_hash(image_name) + '.' + ext
         if header:
             fields =  {
                         "Occlusion": occlusion,
@@ -1303,55 +1609,7 @@ class niobium:
     @staticmethod
     def merge_boxes(results, threshold=(20, 20)):
         console.print(f'[{S.accent}]{len(results)} occlusion pairs.[/{S.accent}]')
-        merged_results = []
-        if len(results) == 0:
-            return merged_results
-
-        results = sorted(results, key=lambda x: x[0][0][1])
-
-        for i, (bbox1, text1, prob1) in enumerate(results):
-            if i == 0:
-                merged_results.append((bbox1, text1, prob1))
-                continue
-
-            merged = False
-            for j, (bbox2, text2, prob2) in enumerate(merged_results):
-                kek = niobium.calc_sim(bbox1, bbox2)
-                intersect = niobium.does_intersect(bbox1,bbox2)
-                touch = niobium.does_touch(bbox1,bbox2)
-                # print(text1 + " and " + text2)
-                # print(f'TOUCH {touch}')
-                # print(f'INTERSECT {intersect}')
-                if ((kek[0] < threshold[0]) and (kek[1] < threshold[1]) or (intersect or touch)):
-                    merged_bbox = [
-                        [int(min(bbox1[0][0], bbox2[0][0])), int(min(bbox1[0][1], bbox2[0][1]))],
-                        [int(max(bbox1[1][0], bbox2[1][0])), int(min(bbox1[1][1], bbox2[1][1]))],
-                        [int(max(bbox1[2][0], bbox2[2][0])), int(max(bbox1[2][1], bbox2[2][1]))],
-                        [int(min(bbox1[3][0], bbox2[3][0])), int(max(bbox1[3][1], bbox2[3][1]))]
-                    ]
-                    merged_text = text1 + " " + text2
-                    merged_prob = max(prob1, prob2)
-                    del merged_results[j]  # Remove the old bbox2
-                    merged_results.append((merged_bbox, merged_text, merged_prob))
-                    merged = True
-                    break
-
-            if not merged:
-                merged_results.append((bbox1, text1, prob1))
-
-        # final_results = []
-        # for bbox1, text1, prob1 in merged_results:
-        #     overlapping = False
-        #     for bbox2, _, _ in merged_results:
-        #         if bbox1 != bbox2:
-        #             if bbox1[0][0] < bbox2[1][0] and bbox1[1][0] > bbox2[0][0] and bbox1[0][1] < bbox2[2][1] and bbox1[2][
-        #                  1] > bbox2[0][1]:
-        #                 if prob1 <= prob2:
-        #                     overlapping = True
-        #                     break
-        #     if not overlapping:
-        #         final_results.append((bbox1, text1, prob1))
-        return merged_results
+        return merge.merge_boxes(results, threshold)
 
     @staticmethod
     def get_images_in_directory(directory):
@@ -1362,19 +1620,36 @@ class niobium:
         return image_files
 
     @staticmethod
-    def _classify_page_images(page):
+    def _classify_image_rect(width, height, page_area, rules=None):
+        """Kind of an image shown at width x height points on a page: icon, strip, background or figure."""
+        rules = {**DECORATIVE_RULES, **(rules or {})}
+        aspect = max(width, height) / min(width, height)
+        area_ratio = (width * height) / page_area if page_area > 0 else 0
+        if width < rules["icon_size"] and height < rules["icon_size"]:
+            return "icon"
+        if aspect > rules["strip_aspect"]:
+            return "strip"
+        if area_ratio > rules["background_area"]:
+            return "background"
+        return "figure"
+
+    @staticmethod
+    def _classify_page_images(page, rules=None):
         """Classify embedded images on a PDF page by shape and size.
 
         Returns (meaningful, decorative) where each is a list of dicts with
-        keys: xref, width, height, aspect, area_ratio, kind.
-
-        Classification rules (all in PDF points):
-          - icon:       both dimensions < 50pt
-          - strip:      aspect ratio > 5:1 (banners, rules, decorative bars)
-          - background: covers > 80% of page area (full-page scan)
+        keys: xref, width, height, aspect, area_ratio, kind, region. region
+        is (left, top, width, height) of the image as fractions of the page.
+
+        Classification rules (all in PDF points; thresholds from rules,
+        defaults in DECORATIVE_RULES):
+          - icon:       both dimensions < icon_size (50pt)
+          - strip:      aspect ratio > strip_aspect (5:1; banners, rules, decorative bars)
+          - background: covers > background_area (80%) of page area (full-page scan)
           - figure:     everything else (diagrams, charts, photos)
         """
-        page_area = page.rect.width * page.rect.height
+        page_rect = page.rect
+        page_area = page_rect.width * page_rect.height
         meaningful = []
         decorative = []
         for img_info in page.get_images(full=True):
@@ -1387,97 +1662,452 @@ class niobium:
                 area_ratio = (w * h) / page_area if page_area > 0 else 0
                 entry = dict(xref=xref, width=w, height=h, aspect=round(aspect, 1),
                              area_ratio=round(area_ratio, 2))
-                if w < 50 and h < 50:
-                    entry["kind"] = "icon"
-                    decorative.append(entry)
-                elif aspect > 5:
-                    entry["kind"] = "strip"
-                    decorative.append(entry)
-                elif area_ratio > 0.8:
-                    entry["kind"] = "background"
-                    decorative.append(entry)
-                else:
-                    entry["kind"] = "figure"
+                entry["region"] = [
+                    round((rect.x0 - page_rect.x0) / page_rect.width, 4),
+                    round((rect.y0 - page_rect.y0) / page_rect.height, 4),
+                    round(w / page_rect.width, 4),
+                    round(h / page_rect.height, 4),
+                ]
+                entry["kind"] = niobium._classify_image_rect(w, h, page_area, rules)
+                if entry["kind"] == "figure":
                     meaningful.append(entry)
+                else:
+                    decorative.append(entry)
         return meaningful, decorative
 
     @staticmethod
-    def render_pdf_pages(file, pages=None, dpi=200):
+    def render_pdf_pages(file, pages=None, dpi=200, lookahead=0, workers=1, markdown_window=16, decorative=None,
+                         render=None, use_cache=False):
         """Render PDF pages for smart card generation.
 
-        For each page, extracts structured markdown and classifies embedded
+        file is a PdfSession or a path. For each page, extracts structured markdown and classifies embedded
         images by shape. Pages with meaningful figures (not icons, banners, or
         full-page scans) are also rendered as images so Claude can see diagrams.
 
-        Returns list of (page_index, image_or_None, markdown_text, page_label).
-        Markdown is always extracted. Image is rendered only for pages with
-        meaningful visual content that text alone cannot capture.
+        Yields (page_index, ImageHandle_or_None, markdown_text, page_label, figures)
+        one page at a time, so memory does not grow with the document. Markdown is
+        always extracted. Image is rendered only for pages with meaningful
+        visual content that text alone cannot capture; figures then lists the
+        regions of its figures (see _classify_page_images), otherwise it is
+        empty. With lookahead > 0, up
+        to that many pages are prepared in a background thread while the
+        caller works on the current one. With workers > 1, pages are analyzed
+        by that many processes, each with its own document handle, and still
+        come back in page order.
+
+        Markdown is extracted markdown_window pages per pymupdf4llm call (0 =
+        all selected pages in one call), so document-level layout setup is
+        paid once per window instead of once per page. decorative holds the
+        image classification thresholds (see _classify_page_images).
+
+        render is the resolution policy (see _page_zoom); without one every
+        page is rendered at dpi. Each rendered page reports its size and
+        estimated image tokens, and the total is printed at the end.
+
+        With use_cache, the analysis of every page (markdown, classification
+        and render) is stored in the page cache, keyed by the page's
+        fingerprint (see PdfSession.page_fingerprint) and the settings above;
+        cached pages are not rendered again, only the missing ones are
+        analyzed. Pages left unchanged in a revised PDF keep their entries.
+        """
+        cached = {}
+        if use_cache:
+            with open_pdf(file) as pdf:
+                page_indices = sorted(pages) if pages else list(range(pdf.page_count))
+                fingerprints = {i: pdf.page_fingerprint(i) for i in page_indices}
+                labels = pdf.labels
+            settings = niobium._page_cache_settings(dpi, decorative, render)
+            for i in page_indices:
+                hit = get_cached_page(fingerprints[i], settings)
+                if hit is not None:
+                    cached[i] = hit
+            if cached:
+                console.print(f"[{S.muted}]{len(cached)} of {len(page_indices)} page(s) found in the page cache[/{S.muted}]")
+            pages = [i for i in page_indices if i not in cached]
+
+        if use_cache and not pages:
+            analyses = iter(())
+        elif workers > 1:
+            analyses = niobium._iter_pdf_pages_parallel(
+                file, pages, dpi, workers, lookahead, markdown_window, decorative, render,
+            )
+        else:
+            analyses = niobium._iter_pdf_pages(file, pages, dpi, markdown_window, decorative, render)
+
+        if use_cache:
+            stream = niobium._cached_page_results(analyses, page_indices, cached, fingerprints, labels, settings)
+        else:
+            stream = map(niobium._page_result, analyses)
+        if workers <= 1 and lookahead > 0:
+            stream = Pipeline([], queue_size=lookahead).run(stream)
+        return niobium._report_image_tokens(stream)
+
+    @staticmethod
+    def _page_cache_settings(dpi, decorative, render):
+        """Everything besides the PDF bytes that page analysis depends on (page cache key)."""
+        return {
+            "version": PAGE_CACHE_VERSION,
+            "pymupdf": fitz.VersionBind,
+            "pymupdf4llm": pymupdf4llm.__version__,
+            "dpi": dpi,
+            "decorative": decorative,
+            "render": render,
+        }
+
+    @staticmethod
+    def _cached_page_results(analyses, page_indices, cached, fingerprints, labels, settings):
+        """Yield render_pdf_pages tuples in page order, from the page cache where
+        possible and otherwise from analyses (which covers the missing pages),
+        storing every newly analyzed page. Cached pages take their label from
+        labels, since an unchanged page may have moved within the PDF."""
+        for i in page_indices:
+            if i in cached:
+                data, image_png = cached[i]
+                image = ImageHandle.from_png(image_png) if image_png is not None else None
+                yield niobium._page_result(
+                    (i, labels[i], data["markdown"], data["meaningful"], data["decorative"], image), cached=True,
+                )
+                continue
+            analysis = next(analyses)
+            result = niobium._page_result(analysis)
+            _, _, md, meaningful, decorative, _ = analysis
+            set_cached_page(
+                fingerprints[i], settings,
+                {"markdown": md, "meaningful": meaningful, "decorative": decorative},
+                result[1].png if result[1] is not None else None,
+            )
+            yield result
+
+    @staticmethod
+    def _report_image_tokens(stream):
+        n_images = tokens = 0
+        for page in stream:
+            if page[1] is not None:
+                n_images += 1
+                tokens += estimate_image_tokens(*page[1].size)
+            yield page
+        if n_images:
+            console.print(f"[{S.muted}]{n_images} page image(s), ~{tokens} image tokens in total[/{S.muted}]")
+
+    @staticmethod
+    def _page_zoom(page, meaningful, dpi, render=None):
+        """Zoom (pixels per point) for rendering a page that goes to Claude.
+
+        Without an adaptive render policy every page uses dpi. With one, the
+        zoom aims for figure_edge pixels along the largest figure's long side
+        (small figures get more resolution, large ones less), never drops
+        below min_dpi, and is capped by dpi, by max_edge pixels on the page's
+        long side and by max_tokens estimated image tokens for the page.
+        """
+        if not render or not render.get("adaptive", True):
+            return dpi / 72
+        w, h = page.rect.width, page.rect.height
+        figure = max((max(m["width"], m["height"]) for m in meaningful), default=0)
+        zoom = render["figure_edge"] / figure if figure and render.get("figure_edge") else dpi / 72
+        zoom = max(zoom, render.get("min_dpi", 0) / 72)
+        caps = [dpi / 72]
+        if render.get("max_edge"):
+            caps.append(render["max_edge"] / max(w, h))
+        if render.get("max_tokens"):
+            caps.append((render["max_tokens"] * TOKEN_PIXELS / (w * h)) ** 0.5)
+        return min(zoom, *caps)
+
+    @staticmethod
+    def _page_windows(page_indices, window):
+        page_indices = list(page_indices)
+        window = window if window and window > 0 else max(1, len(page_indices))
+        return [page_indices[k:k + window] for k in range(0, len(page_indices), window)]
+
+    @staticmethod
+    def _markdown_pages(doc, page_indices):
+        """Markdown for several pages from one pymupdf4llm pass, keyed by page index."""
+        chunks = pymupdf4llm.to_markdown(doc, pages=list(page_indices), page_chunks=True)
+        # Chunks carry 1-based page numbers ("page" in older pymupdf4llm releases)
+        return {
+            chunk["metadata"].get("page_number", chunk["metadata"].get("page")) - 1: chunk["text"]
+            for chunk in chunks
+        }
+
+    @staticmethod
+    def _analyze_page(doc, i, dpi, md, decorative=None, render=None):
+        """Image classification and (for pages with figures) raw RGB render of one page.
+
+        md is the page's markdown from _markdown_pages and is passed through.
+        Returns (page_index, page_label, markdown, meaningful, decorative, pixels)
+        where pixels is (width, height, samples) or None. Plain data, so it
+        can come back from a worker process.
         """
-        doc = fitz.Document(file)
-        page_indices = sorted(pages) if pages else range(len(doc))
-        zoom = dpi / 72
-        mat = fitz.Matrix(zoom, zoom)
-        rendered = []
-        for i in tqdm(page_indices, desc="rendering pages"):
-            page = doc.load_page(i)
-            page_label = page.get_label() or str(i + 1)
-            md = pymupdf4llm.to_markdown(doc, pages=[i])
-            meaningful, decorative = niobium._classify_page_images(page)
-            # Build a concise summary for the terminal
-            parts = []
-            for img in meaningful:
-                parts.append(f"[{S.success}]{img['kind']}[/{S.success}] {img['width']:.0f}x{img['height']:.0f}pt")
-            for img in decorative:
-                parts.append(f"[{S.muted}]{img['kind']} {img['width']:.0f}x{img['height']:.0f}pt[/{S.muted}]")
-            img_summary = ", ".join(parts) if parts else "no images"
-            if meaningful:
-                pix = page.get_pixmap(matrix=mat)
-                img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
-                rendered.append((i, img, md, page_label))
-                console.print(f"  [{S.accent}]Page {page_label}:[/{S.accent}] {img_summary} → [bold]image + text[/bold]")
+        page = doc.load_page(i)
+        page_label = page.get_label() or str(i + 1)
+        meaningful, decorative = niobium._classify_page_images(page, decorative)
+        pixels = None
+        if meaningful:
+            zoom = niobium._page_zoom(page, meaningful, dpi, render)
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            pixels = (pix.width, pix.height, pix.samples)
+        return i, page_label, md, meaningful, decorative, pixels
+
+    @staticmethod
+    def _page_result(analysis, cached=False):
+        """Print the terminal summary for an analyzed page and turn it into a render_pdf_pages tuple.
+
+        The pixels of a cached page are already an ImageHandle.
+        """
+        i, page_label, md, meaningful, decorative, pixels = analysis
+        # Build a concise summary for the terminal
+        parts = []
+        for img in meaningful:
+            parts.append(f"[{S.success}]{img['kind']}[/{S.success}] {img['width']:.0f}x{img['height']:.0f}pt")
+        for img in decorative:
+            parts.append(f"[{S.muted}]{img['kind']} {img['width']:.0f}x{img['height']:.0f}pt[/{S.muted}]")
+        img_summary = ", ".join(parts) if parts else "no images"
+        if cached:
+            img_summary += f" [{S.muted}](cached)[/{S.muted}]"
+        if pixels is not None:
+            if isinstance(pixels, ImageHandle):
+                img = pixels
             else:
-                rendered.append((i, None, md, page_label))
-                console.print(f"  [{S.accent}]Page {page_label}:[/{S.accent}] {img_summary} → [bold]text[/bold]")
-        return rendered
+                img = ImageHandle(Image.frombytes("RGB", pixels[:2], pixels[2]))
+            width, height = img.size
+            console.print(f"  [{S.accent}]Page {page_label}:[/{S.accent}] {img_summary} → [bold]image + text[/bold] "
+                          f"[{S.muted}]({width}x{height}px, ~{estimate_image_tokens(width, height)} tokens)[/{S.muted}]")
+            return (i, img, md, page_label, [m["region"] for m in meaningful])
+        console.print(f"  [{S.accent}]Page {page_label}:[/{S.accent}] {img_summary} → [bold]text[/bold]")
+        return (i, None, md, page_label, [])
 
     @staticmethod
-    def extract_images_from_pdf(file,path=None,pages=None):
-        if path:
-            ct = datetime.now()
-            console.print(f'[{S.accent}]Images will be extracted from {file}[/{S.accent}]')
-            opdir = os.path.join(path,'niobium-pdf2img',os.path.basename(file).split('.')[0] + ct.strftime("_%H-%M-%S"))
-            if not os.path.exists(opdir):
-                os.makedirs(opdir)
-        else:
-            opdir = os.path.dirname(os.path.abspath(file))
-            opdir = os.path.join(opdir, 'niobium-io')
-            if not os.path.exists(opdir):
-                os.makedirs(opdir)
-        
-        all_images = []
-        doc = fitz.Document(file)
-        page_indices = sorted(pages) if pages else range(len(doc))
+    def _iter_pdf_pages(file, pages, dpi, markdown_window, decorative=None, render=None):
+        with open_pdf(file) as pdf:
+            page_indices = sorted(pages) if pages else range(pdf.page_count)
+            for window in niobium._page_windows(page_indices, markdown_window):
+                md = niobium._markdown_pages(pdf.doc, window)
+                for i in window:
+                    yield niobium._analyze_page(pdf.doc, i, dpi, md.get(i, ""), decorative, render)
+
+    @staticmethod
+    def _iter_pdf_pages_parallel(file, pages, dpi, workers, lookahead, markdown_window, decorative=None, render=None):
+        """Analyze pages on a process pool, yielding results in page order.
+
+        Each task is one markdown window. At most lookahead + workers pages
+        are in flight: windows are shrunk so every worker has one while the
+        rest of the budget is read ahead, and finished renders do not pile up
+        ahead of the caller.
+        """
+        with open_pdf(file) as pdf:
+            page_indices = sorted(pages) if pages else range(pdf.page_count)
+            path = pdf.path
+        console.print(f"[{S.muted}]Analyzing pages with {workers} worker processes[/{S.muted}]")
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_page_worker_init,
+            initargs=(path, dpi, decorative, render),
+        )
+        budget = lookahead + workers
+        window = max(1, budget // workers)
+        if markdown_window and markdown_window > 0:
+            window = min(window, markdown_window)
+        windows = niobium._page_windows(page_indices, window)
+        max_in_flight = max(1, budget // window)
+        in_flight = deque()
+        try:
+            for window in windows:
+                in_flight.append(pool.submit(_page_worker_analyze, window))
+                if len(in_flight) >= max_in_flight:
+                    yield from in_flight.popleft().result()
+            while in_flight:
+                yield from in_flight.popleft().result()
+        finally:
+            # Drop windows not started yet (shutdown's cancel_futures needs Python 3.9)
+            for future in in_flight:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+    @staticmethod
+    def _pdf_image(doc, xref, raw=True):
+        """ImageHandle for an embedded PDF image.
+
+        With raw, JPEG/PNG streams are wrapped as stored in the PDF (decoded
+        lazily, hashed and uploaded without re-encoding). Other encodings go
+        through a pixmap, converted to RGB.
+        """
+        if raw:
+            info = doc.extract_image(xref)
+            if info and info.get("ext") in WEB_FORMATS:
+                return ImageHandle.from_bytes(info["image"], info["ext"])
+        pix = fitz.Pixmap(doc, xref)
+        if pix.alpha:
+            pix = fitz.Pixmap(pix, 0)
+        if pix.colorspace is None or pix.colorspace.n not in (3, 4):
+            pix = fitz.Pixmap(fitz.csRGB, pix)
+        mode = "RGB" if pix.n == 3 else "CMYK"
+        return ImageHandle(Image.frombytes(mode, (pix.width, pix.height), pix.samples))
+
+    @staticmethod
+    def iter_pdf_images(file, pages=None, raw=True):
+        """Yield (page_index, xref, ImageHandle) for each distinct embedded image.
+
+        An image placed on many pages (a logo, a repeated figure) shares one
+        xref and is yielded once, on the first selected page that shows it.
+        """
+        with open_pdf(file) as pdf:
+            page_indices = sorted(pages) if pages else range(pdf.page_count)
+            seen = set()
+            for i in tqdm(page_indices, desc="pages"):
+                for img in pdf.doc.get_page_images(i):
+                    xref = img[0]
+                    if xref in seen:
+                        continue
+                    seen.add(xref)
+                    yield i, xref, niobium._pdf_image(pdf.doc, xref, raw)
+
+    @staticmethod
+    def extract_images_from_pdf(file,path=None,pages=None,raw=True):
+        """Save the distinct embedded images of a PDF under path.
+
+        Without a path, returns a generator of PIL images instead. With raw,
+        JPEG/PNG images are written exactly as stored in the PDF; everything
+        else is saved as JPEG.
+        """
+        if path == None:
+            return (handle.image for _, _, handle in niobium.iter_pdf_images(file, pages, raw))
+
+        ct = datetime.now()
+        console.print(f'[{S.accent}]Images will be extracted from {os.fspath(file)}[/{S.accent}]')
+        opdir = os.path.join(path,'niobium-pdf2img',os.path.basename(file).split('.')[0] + ct.strftime("_%H-%M-%S"))
+        if not os.path.exists(opdir):
+            os.makedirs(opdir)
         console.print(f'[{S.accent}]Extracted images will be saved to {opdir}[/{S.accent}]')
         count = 1
-        for i in tqdm(page_indices, desc="pages"):
-            for img in tqdm(doc.get_page_images(i), desc="page_images"):
-                xref = img[0]
-                pix = fitz.Pixmap(doc, xref)
-                if path:
-                    pix.save(os.path.join(opdir,f"{count:02d}.jpg"),jpg_quality=50)
-                    count += 1
-                else:
-                    if pix.n < 5:
-                        mode = "RGB"
-                    else:
-                        mode = "CMYK"
-                    img_pil = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
-                    all_images.append(img_pil)
+        for _, _, handle in niobium.iter_pdf_images(file, pages, raw):
+            if handle.data is not None:
+                handle.save_encoded(os.path.join(opdir, f"{count:02d}.{handle.ext}"))
+            else:
+                handle.image.convert("RGB").save(os.path.join(opdir, f"{count:02d}.jpg"), quality=50)
+            count += 1
+        console.print(f'[bold {S.success}]{count-1} images have been saved.[/bold {S.success}]')
 
-        if path == None:
-            return all_images
-        else:
-            console.print(f'[bold {S.success}]{count-1} images have been saved.[/bold {S.success}]')
+    @staticmethod
+    def _text_layer_results(words, rect, zoom):
+        """Turn PDF words inside rect into OCR-shaped (bbox, text, prob) line boxes.
+
+        Words are grouped by (block, line) like EasyOCR's line-level output and
+        mapped into the pixel space of rect rendered at zoom. prob is 1.0 since
+        the text is exact.
+        """
+        lines = {}
+        for x0, y0, x1, y1, word, block_no, line_no, _ in words:
+            cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+            if rect.x0 <= cx <= rect.x1 and rect.y0 <= cy <= rect.y1:
+                lines.setdefault((block_no, line_no), []).append((x0, y0, x1, y1, word))
+        results = []
+        for line in lines.values():
+            lx0 = int((min(w[0] for w in line) - rect.x0) * zoom)
+            ly0 = int((min(w[1] for w in line) - rect.y0) * zoom)
+            lx1 = int(round((max(w[2] for w in line) - rect.x0) * zoom))
+            ly1 = int(round((max(w[3] for w in line) - rect.y0) * zoom))
+            text = " ".join(w[4] for w in line)
+            results.append(([[lx0, ly0], [lx1, ly0], [lx1, ly1], [lx0, ly1]], text, 1.0))
+        return results
+
+    @staticmethod
+    def _text_layer_coverage(results, rect, zoom):
+        """Share of rect (rendered at zoom) spanned by the bounding box of text-layer results."""
+        x0 = min(bbox[0][0] for bbox, _, _ in results)
+        y0 = min(bbox[0][1] for bbox, _, _ in results)
+        x1 = max(bbox[2][0] for bbox, _, _ in results)
+        y1 = max(bbox[2][1] for bbox, _, _ in results)
+        return (x1 - x0) * (y1 - y0) / (rect.width * rect.height * zoom * zoom)
+
+    @staticmethod
+    def extract_occlusion_sources(file, pages=None, text_layer=True, dpi=200, raw=True, decorative=None):
+        """Yield image-occlusion inputs from a PDF, one at a time.
+
+        Yields (ImageHandle, results) pairs. When text_layer is on and an
+        embedded image has selectable words on top of it, the figure region
+        is rendered at dpi (so the labels are part of the picture) and results
+        holds the word boxes from the PDF, ready for merge_boxes/filter_results.
+        The words are only trusted when they span TEXT_LAYER_COVERAGE of the
+        figure; otherwise the rendered region comes back with results=None,
+        so OCR reads labels baked into the raster as well. Raster-only
+        images, and page-sized images (whose words are the page's text, not
+        labels), come back with results=None too; with raw they keep their
+        JPEG/PNG stream from the PDF.
+
+        Images repeated across pages are yielded once: raster-only ones per
+        xref, labelled ones per xref and word boxes. An image placed both with
+        and without labels is yielded for each kind. When decorative holds
+        classification thresholds (see _classify_page_images), only placements
+        classified as figures are used; icons, strips and page backgrounds
+        never reach OCR.
+        """
+        with open_pdf(file) as pdf:
+            doc = pdf.doc
+            page_indices = sorted(pages) if pages else range(pdf.page_count)
+            zoom = dpi / 72
+            mat = fitz.Matrix(zoom, zoom)
+            background_area = (decorative or DECORATIVE_RULES)["background_area"]
+            seen = set()
+            n_text = n_ocr = n_repeat = n_decorative = 0
+            for i in tqdm(page_indices, desc="pages"):
+                page = doc.load_page(i)
+                page_area = page.rect.width * page.rect.height
+                words = page.get_text("words") if text_layer else []
+                for img in doc.get_page_images(i):
+                    xref = img[0]
+                    rects = page.get_image_rects(xref)
+                    if decorative is not None:
+                        rects = [
+                            r for r in rects
+                            if r.width >= 1 and r.height >= 1
+                            and niobium._classify_image_rect(r.width, r.height, page_area, decorative) == "figure"
+                        ]
+                        if not rects:
+                            n_decorative += 1
+                            continue
+                    labelled = []
+                    unlabelled = not rects
+                    for rect in rects:
+                        results = None
+                        # The words over a page-sized image are the page's own text
+                        if words and rect.width * rect.height < background_area * page_area:
+                            results = niobium._text_layer_results(words, rect, zoom)
+                        if results:
+                            labelled.append((rect, results))
+                        else:
+                            unlabelled = True
+                    if labelled:
+                        for rect, results in labelled:
+                            key = (xref, repr(results))
+                            if key in seen:
+                                n_repeat += 1
+                                continue
+                            seen.add(key)
+                            pix = page.get_pixmap(matrix=mat, clip=rect)
+                            handle = ImageHandle(Image.frombytes("RGB", (pix.width, pix.height), pix.samples))
+                            if niobium._text_layer_coverage(results, rect, zoom) >= TEXT_LAYER_COVERAGE:
+                                n_text += 1
+                                yield (handle, results)
+                            else:
+                                # A few words over a raster that may carry its own labels
+                                n_ocr += 1
+                                yield (handle, None)
+                        if not unlabelled:
+                            continue
+                    if xref in seen:
+                        n_repeat += 1
+                        continue
+                    seen.add(xref)
+                    n_ocr += 1
+                    yield (niobium._pdf_image(doc, xref, raw), None)
+        summary = f"{n_text + n_ocr} image(s) extracted from the PDF"
+        if text_layer:
+            summary += f" ({n_text} use the PDF text layer, {n_ocr} need OCR)"
+        if n_repeat:
+            summary += f", {n_repeat} repeated image(s) skipped"
+        if n_decorative:
+            summary += f", {n_decorative} decorative image(s) skipped"
+        console.print(f"[{S.muted}]{summary}[/{S.muted}]")
 
     @staticmethod
     def create_deck(deck_name):
@@ -1613,3 +2243,22 @@ class niobium:
             console.print(f"[{S.muted}]\\[{it}/{len(img_list)}][/{S.muted}]")
             niobium.add_basic_deck(img_path, deck_name)
             it += 1
+
+
+# ── PDF page-analysis workers (see niobium.render_pdf_pages) ─────────
+# Each worker process opens the document once and keeps the handle.
+
+_page_doc = None
+_page_args = None
+
+
+def _page_worker_init(file, dpi, decorative, render):
+    global _page_doc, _page_args
+    _page_doc = fitz.Document(file)
+    _page_args = (dpi, decorative, render)
+
+
+def _page_worker_analyze(window):
+    md = niobium._markdown_pages(_page_doc, window)
+    dpi, decorative, render = _page_args
+    return [niobium._analyze_page(_page_doc, i, dpi, md.get(i, ""), decorative, render) for i in window]
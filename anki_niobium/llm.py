@@ -1,12 +1,17 @@
 import os
 import json
 import base64
+import threading
+from io import BytesIO
 import anthropic
+from PIL import Image
 from rich.console import Console, Group
 from rich.panel import Panel
 from rich.table import Table
 from rich.text import Text
 from anki_niobium.cache import content_hash_bytes, get_cached_claude_response, set_cached_claude_response
+from anki_niobium.image import encode_payload, estimate_image_tokens, fit_size
+from anki_niobium.ratelimit import RequestScheduler
 from anki_niobium.theme import S
 
 console = Console()
@@ -78,15 +83,118 @@ When the user provides instructions below, they are ABSOLUTE — override ALL de
   the user's constraint.
 """
 
+# Default encoding of images sent to Claude (llm.image_payload)
+PAYLOAD_POLICY = {"enabled": True, "max_edge": 1568, "max_pixels": 1_150_000, "quality": 90, "min_psnr": 38.0}
+
 # Module-level client cache to avoid recreating per image in batch mode
 _client_cache = {}
+# Request schedulers by rate-limit settings; one is shared by all threads of a run
+_schedulers = {}
+# Smart generation calls Claude from several threads (llm.concurrency)
+_lock = threading.Lock()
+
+
+def _get_client(api_key, base_url=None):
+    """Reuse Anthropic client across calls within the same session; the client is thread-safe.
+
+    base_url (llm.base_url) points the client at another server, e.g. a
+    local stand-in for testing; None uses the SDK default.
+    """
+    with _lock:
+        if (api_key, base_url) not in _client_cache:
+            _client_cache[(api_key, base_url)] = anthropic.Anthropic(api_key=api_key, base_url=base_url)
+        return _client_cache[(api_key, base_url)]
+
+
+def _get_scheduler(llm_config):
+    """RequestScheduler for the llm.rate_limit / llm.retry settings, shared across calls."""
+    limits = llm_config.get("rate_limit") or {}
+    retry = llm_config.get("retry") or {}
+    key = (limits.get("requests_per_minute"), limits.get("input_tokens_per_minute"), json.dumps(retry, sort_keys=True))
+    with _lock:
+        if key not in _schedulers:
+            _schedulers[key] = RequestScheduler(key[0], key[1], retry)
+        return _schedulers[key]
+
+
+def _estimate_input_tokens(params):
+    """Rough input-token count of a Messages request: ~4 characters per text token plus image tokens."""
+    chars = sum(len(block["text"]) for block in params["system"])
+    tokens = 0
+    for message in params["messages"]:
+        for block in message["content"]:
+            if block["type"] == "text":
+                chars += len(block["text"])
+            elif block["type"] == "image":
+                with Image.open(BytesIO(base64.b64decode(block["source"]["data"]))) as img:
+                    tokens += estimate_image_tokens(*img.size)
+    return tokens + chars // 4
+
+
+def _image_blocks(images, llm_config, label=None, lossy=False):
+    """Image content blocks for a list of encoded images, as compact as llm.image_payload allows.
+
+    Images are scaled down to what Claude reads and re-encoded (see
+    encode_payload); lossy encodings are only tried with lossy, for
+    photos. The bytes and estimated image tokens saved are printed. Aspect ratios are kept, so fractional coordinates in Claude's
+    answer apply to the original images unchanged.
+    """
+    policy = {**PAYLOAD_POLICY, **(llm_config.get("image_payload") or {})}
+    if not policy["enabled"]:
+        return [_image_block(data, "image/png") for data in images]
+
+    blocks = []
+    bytes_in = bytes_out = tokens_in = tokens_out = 0
+    for data in images:
+        encoded, media_type, original_size, size = encode_payload(
+            data, max_edge=policy["max_edge"], max_pixels=policy["max_pixels"],
+            quality=policy["quality"], min_psnr=policy["min_psnr"], lossy=lossy,
+        )
+        blocks.append(_image_block(encoded, media_type))
+        bytes_in += len(data)
+        bytes_out += len(encoded)
+        # Claude itself scales the original down to fit_size before billing it
+        tokens_in += estimate_image_tokens(*fit_size(*original_size))
+        tokens_out += estimate_image_tokens(*size)
+
+    with _lock:
+        _session_totals["image_bytes_in"] += bytes_in
+        _session_totals["image_bytes_out"] += bytes_out
+        session_saved = _session_totals["image_bytes_in"] - _session_totals["image_bytes_out"]
+    prefix = f"{label} " if label else ""
+    kinds = ", ".join(sorted({block["source"]["media_type"].split("/")[1] for block in blocks}))
+    console.print(
+        f"[{S.muted}]  {prefix}image payload: {bytes_in / 1024:,.0f} KB → {bytes_out / 1024:,.0f} KB ({kinds}) "
+        f"| ~{tokens_in:,} → {tokens_out:,} image tokens "
+        f"| session: {session_saved / 1024 ** 2:.1f} MB saved[/{S.muted}]"
+    )
+    return blocks
+
+
+def _image_block(data, media_type):
+    return {
+        "type": "image",
+        "source": {
+            "type": "base64",
+            "media_type": media_type,
+            "data": base64.b64encode(data).decode("utf-8"),
+        },
+    }
 
 
-def _get_client(api_key):
-    """Reuse Anthropic client across calls within the same session."""
-    if api_key not in _client_cache:
-        _client_cache[api_key] = anthropic.Anthropic(api_key=api_key)
-    return _client_cache[api_key]
+def _parse_response_json(response_text):
+    """Parse Claude's JSON answer, stripping markdown code fences if present."""
+    if "```" in response_text:
+        parts = response_text.split("```")
+        for part in parts[1:]:
+            cleaned = part.strip()
+            if cleaned.startswith("json"):
+                cleaned = cleaned[4:]
+            cleaned = cleaned.strip()
+            if cleaned.startswith("{"):
+                response_text = cleaned
+                break
+    return json.loads(response_text.strip())
 
 
 # Pricing per million tokens (USD) — updated as of 2025
@@ -96,28 +204,81 @@ _PRICING = {
     "claude-haiku-4-5":   {"input": 0.80, "output": 4.00},
 }
 _DEFAULT_PRICING = {"input": 3.00, "output": 15.00}
+# Prompt cache writes and reads, as multiples of the input price
+_CACHE_WRITE_RATE = 1.25
+_CACHE_READ_RATE = 0.1
 
 # Running session totals
-_session_totals = {"input_tokens": 0, "output_tokens": 0, "cost": 0.0, "calls": 0}
+_session_totals = {
+    "input_tokens": 0, "output_tokens": 0, "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0,
+    "cost": 0.0, "calls": 0, "image_bytes_in": 0, "image_bytes_out": 0,
+}
+
+
+def _system_blocks(prompt, suffix, llm_config):
+    """System prompt as content blocks, with prompt marked as a cacheable prefix.
+
+    prompt is the part shared by every request of a run (the built-in
+    prompt plus instructions); suffix, which may vary per request, follows
+    it uncached. With llm.prompt_cache off the blocks carry no marker.
+    Claude only caches a prefix longer than the model's minimum (1024
+    tokens on Sonnet), so a short prompt is still billed in full.
+    """
+    blocks = [{"type": "text", "text": prompt}]
+    if llm_config.get("prompt_cache", True):
+        blocks[0]["cache_control"] = {"type": "ephemeral"}
+    if suffix:
+        blocks.append({"type": "text", "text": suffix})
+    return blocks
+
+
+def _usage_tokens(usage):
+    """(input, output, cache write, cache read) token counts of a response's usage."""
+    return (
+        usage.input_tokens,
+        usage.output_tokens,
+        getattr(usage, "cache_creation_input_tokens", None) or 0,
+        getattr(usage, "cache_read_input_tokens", None) or 0,
+    )
 
 
-def _log_usage(response, model):
-    """Log token usage and estimated cost from an API response."""
-    usage = response.usage
-    input_tokens = usage.input_tokens
-    output_tokens = usage.output_tokens
+def _usage_cost(usage, model):
+    """Estimated USD cost of a response's usage, prompt cache writes and reads included."""
+    input_tokens, output_tokens, cache_write, cache_read = _usage_tokens(usage)
     prices = _PRICING.get(model, _DEFAULT_PRICING)
-    cost = (input_tokens * prices["input"] + output_tokens * prices["output"]) / 1_000_000
+    return (
+        (input_tokens + cache_write * _CACHE_WRITE_RATE + cache_read * _CACHE_READ_RATE) * prices["input"]
+        + output_tokens * prices["output"]
+    ) / 1_000_000
 
-    _session_totals["input_tokens"] += input_tokens
-    _session_totals["output_tokens"] += output_tokens
-    _session_totals["cost"] += cost
-    _session_totals["calls"] += 1
 
+def _log_usage(response, model, label=None):
+    """Log token usage and estimated cost from an API response.
+
+    label names the request (e.g. "page 3") when several are in flight.
+    Prompt cache writes and reads are shown when there are any.
+    """
+    input_tokens, output_tokens, cache_write, cache_read = _usage_tokens(response.usage)
+    cost = _usage_cost(response.usage, model)
+
+    with _lock:
+        _session_totals["input_tokens"] += input_tokens
+        _session_totals["output_tokens"] += output_tokens
+        _session_totals["cache_creation_input_tokens"] += cache_write
+        _session_totals["cache_read_input_tokens"] += cache_read
+        _session_totals["cost"] += cost
+        _session_totals["calls"] += 1
+        session_cost, session_calls = _session_totals["cost"], _session_totals["calls"]
+        session_read = _session_totals["cache_read_input_tokens"]
+
+    prefix = f"{label} " if label else ""
+    cache = f"| prompt cache: {cache_write:,} written / {cache_read:,} read " if cache_write or cache_read else ""
+    session_cache = f", {session_read:,} tokens read from prompt cache" if session_read else ""
     console.print(
-        f"[{S.muted}]  tokens: {input_tokens:,} in / {output_tokens:,} out "
+        f"[{S.muted}]  {prefix}tokens: {input_tokens:,} in / {output_tokens:,} out "
+        f"{cache}"
         f"| cost: ${cost:.4f} "
-        f"| session: ${_session_totals['cost']:.4f} ({_session_totals['calls']} calls)[/{S.muted}]"
+        f"| session: ${session_cost:.4f} ({session_calls} calls{session_cache})[/{S.muted}]"
     )
 
 
@@ -131,7 +292,9 @@ def smart_filter_results(results, image_bytes, config):
         config: the loaded config dict
 
     Returns:
-        (filtered_results, extra) — same shape as filter_results()
+        (filtered_results, extra) — same shape as filter_results(), or None
+        during a --batch collect pass (config["_batch"], see anki_niobium.batch):
+        a request missing from the cache is then added to the batch instead.
     """
     llm_config = config.get("llm", {})
 
@@ -170,54 +333,40 @@ def smart_filter_results(results, image_bytes, config):
     if not no_cache:
         cached = get_cached_claude_response(image_bytes_hash, text_list_json, model, instructions)
 
+    batch = config.get("_batch")
     if cached is not None:
+        if batch is not None:
+            return None
         data = cached
         from_cache = True
     else:
         # Live API call
-        image_b64 = base64.b64encode(image_bytes).decode("utf-8")
         user_content = [
-            {
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/png",
-                    "data": image_b64,
-                },
-            },
+            # Image files may be photos; PDF figures are kept lossless like page renders
+            *_image_blocks([image_bytes], llm_config, lossy=config.get("_photo_input", False)),
             {
                 "type": "text",
                 "text": f"Here are the OCR-detected text regions:\n\n{text_list_json}\n\nAnalyze this image and classify each region.",
             },
         ]
+        params = dict(
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            system=_system_blocks(system_prompt, None, llm_config),
+            messages=[{"role": "user", "content": user_content}],
+        )
+        if batch is not None:
+            batch.add((image_bytes_hash, text_list_json, model, instructions), params)
+            return None
 
         try:
-            client = _get_client(api_key)
+            client = _get_client(api_key, llm_config.get("base_url"))
             console.print(f"[{S.accent}]Sending image to Claude ({model}) for smart filtering...[/{S.accent}]")
-            response = client.messages.create(
-                model=model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                system=system_prompt,
-                messages=[{"role": "user", "content": user_content}],
-            )
+            response = _get_scheduler(llm_config).create(client, params, _estimate_input_tokens(params))
             _log_usage(response, model)
 
-            response_text = response.content[0].text
-
-            # Strip markdown code fences if present
-            if "```" in response_text:
-                parts = response_text.split("```")
-                for part in parts[1:]:
-                    cleaned = part.strip()
-                    if cleaned.startswith("json"):
-                        cleaned = cleaned[4:]
-                    cleaned = cleaned.strip()
-                    if cleaned.startswith("{"):
-                        response_text = cleaned
-                        break
-
-            data = json.loads(response_text.strip())
+            data = _parse_response_json(response.content[0].text)
             set_cached_claude_response(image_bytes_hash, text_list_json, model, instructions, data)
             from_cache = False
 
@@ -358,21 +507,33 @@ When the user provides instructions below, they are ABSOLUTE — override ALL de
 """
 
 
-def smart_generate_cards(page_index, page_image_bytes, config, max_cards=None, card_type=None, page_text=None, page_label=None):
+def smart_generate_cards(page_index, page_image_bytes, config, max_cards=None, card_type=None, page_text=None,
+                         page_label=None, figure_crops=None):
     """
     Use Claude to analyze page content and generate cards of multiple types.
 
-    Three sending modes based on available content:
-      - text:        markdown only (no figures on page)
-      - image + text: full page render + markdown (page has figures)
-      - image:       image only (standalone image input, no PDF text)
+    Four sending modes based on available content:
+      - text:                markdown only (no figures on page)
+      - image + text (crops): figure crops + markdown (page has small figures)
+      - image + text:        full page render + markdown (page has figures)
+      - image:               image only (standalone image input, no PDF text)
+
+    figure_crops is a list of (png_bytes, (left, top, width, height)) with
+    each region as fractions of the page image. Image-occlusion coordinates
+    Claude gives relative to a crop are mapped back to the page image, so the
+    returned cards always refer to page_image_bytes.
 
     page_label is the user-visible page number (from PDF labels); falls back to
     page_index + 1 when not provided.
+
+    During a --batch collect pass (config["_batch"], see anki_niobium.batch)
+    nothing is generated and None is returned; a request missing from the
+    cache is added to the batch instead.
     """
     display_page = page_label or str(page_index + 1)
     has_image = page_image_bytes is not None
     has_text = page_text is not None and len(page_text.strip()) > 0
+    use_crops = bool(figure_crops) and has_image and has_text
     llm_config = config.get("llm", {})
 
     api_key = llm_config.get("api_key") or os.environ.get("ANTHROPIC_API_KEY")
@@ -397,8 +558,10 @@ def smart_generate_cards(page_index, page_image_bytes, config, max_cards=None, c
         constraints.append(f"Generate no more than {max_cards} cards for this page. This is a CEILING, not a target — if the content only warrants fewer cards, generate fewer. Never pad to reach this number.")
     if card_type:
         constraints.append(f"ONLY generate cards of type '{card_type}'. Do not use any other card type.")
+    # Constraints change with the page (no image), so they follow the cached prefix
+    constraint_text = None
     if constraints:
-        system_prompt += "\nCONSTRAINTS:\n" + "\n".join(f"- {c}" for c in constraints) + "\n"
+        constraint_text = "\nCONSTRAINTS:\n" + "\n".join(f"- {c}" for c in constraints) + "\n"
 
     # Cache key accounts for the sending mode
     if has_image:
@@ -406,6 +569,8 @@ def smart_generate_cards(page_index, page_image_bytes, config, max_cards=None, c
     else:
         content_hash = content_hash_bytes(page_text.encode("utf-8"))
     mode_tag = "img_text" if (has_image and has_text) else ("text" if has_text else "img")
+    if use_crops:
+        mode_tag = "crops" + json.dumps([region for _, region in figure_crops])
     cache_text_key = f"smart_generate_page_{page_index}_max{max_cards}_type{card_type}_mode{mode_tag}"
     no_cache = config.get("_no_cache", False)
 
@@ -413,23 +578,43 @@ def smart_generate_cards(page_index, page_image_bytes, config, max_cards=None, c
     if not no_cache:
         cached = get_cached_claude_response(content_hash, cache_text_key, model, instructions)
 
+    batch = config.get("_batch")
     if cached is not None:
+        if batch is not None:
+            return None
         data = cached
         from_cache = True
     else:
         # Build user message based on available content
-        if has_image and has_text:
+        if use_crops:
+            mode_label = f"image + text (crops), {len(figure_crops)} figure(s)"
+            user_content = []
+            crop_blocks = _image_blocks([crop for crop, _ in figure_crops], llm_config, label=f"page {display_page}")
+            for k, ((_, (left, top, width, height)), crop_block) in enumerate(zip(figure_crops, crop_blocks), 1):
+                user_content.append({
+                    "type": "text",
+                    "text": (
+                        f"Figure {k}, cropped from the page at left={left:.4f}, top={top:.4f}, "
+                        f"width={width:.4f}, height={height:.4f} (fractions of the page):"
+                    ),
+                })
+                user_content.append(crop_block)
+            user_content.append({
+                "type": "text",
+                "text": (
+                    f"These are the figures of page {display_page} of a PDF. "
+                    f"Below is the structured text extracted from the whole page:\n\n"
+                    f"---\n{page_text}\n---\n\n"
+                    f"Use BOTH the figures (for visual content and diagrams) "
+                    f"and the extracted text (for accurate quotes in cloze cards) to generate flashcards. "
+                    f"Each image_occlusion card must use a single figure: add \"figure\": <its number> to the card "
+                    f"and give the occlusion coordinates as fractions of that figure's image."
+                ),
+            })
+        elif has_image and has_text:
             mode_label = "image + text"
-            image_b64 = base64.b64encode(page_image_bytes).decode("utf-8")
             user_content = [
-                {
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": "image/png",
-                        "data": image_b64,
-                    },
-                },
+                *_image_blocks([page_image_bytes], llm_config, label=f"page {display_page}"),
                 {
                     "type": "text",
                     "text": (
@@ -443,16 +628,8 @@ def smart_generate_cards(page_index, page_image_bytes, config, max_cards=None, c
             ]
         elif has_image:
             mode_label = "image"
-            image_b64 = base64.b64encode(page_image_bytes).decode("utf-8")
             user_content = [
-                {
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": "image/png",
-                        "data": image_b64,
-                    },
-                },
+                *_image_blocks([page_image_bytes], llm_config, label=f"page {display_page}"),
                 {
                     "type": "text",
                     "text": f"Analyze this image and generate flashcards.",
@@ -472,32 +649,32 @@ def smart_generate_cards(page_index, page_image_bytes, config, max_cards=None, c
                 },
             ]
 
+        params = dict(
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            system=_system_blocks(system_prompt, constraint_text, llm_config),
+            messages=[{"role": "user", "content": user_content}],
+        )
+        regions = [region for _, region in figure_crops] if use_crops else None
+        if batch is not None:
+            batch.add(
+                (content_hash, cache_text_key, model, instructions), params,
+                postprocess=(lambda data: _map_crop_occlusions(data, regions)) if regions else None,
+            )
+            return None
+
         try:
-            client = _get_client(api_key)
+            client = _get_client(api_key, llm_config.get("base_url"))
             console.print(f"[{S.accent}]Sending page {display_page} ({mode_label}) to Claude ({model})...[/{S.accent}]")
-            response = client.messages.create(
-                model=model,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                system=system_prompt,
-                messages=[{"role": "user", "content": user_content}],
+            response = _get_scheduler(llm_config).create(
+                client, params, _estimate_input_tokens(params), label=f"page {display_page}",
             )
-            _log_usage(response, model)
-
-            response_text = response.content[0].text
-
-            if "```" in response_text:
-                parts = response_text.split("```")
-                for part in parts[1:]:
-                    cleaned = part.strip()
-                    if cleaned.startswith("json"):
-                        cleaned = cleaned[4:]
-                    cleaned = cleaned.strip()
-                    if cleaned.startswith("{"):
-                        response_text = cleaned
-                        break
+            _log_usage(response, model, label=f"page {display_page}")
 
-            data = json.loads(response_text.strip())
+            data = _parse_response_json(response.content[0].text)
+            if regions:
+                _map_crop_occlusions(data, regions)
             set_cached_claude_response(content_hash, cache_text_key, model, instructions, data)
             from_cache = False
 
@@ -509,6 +686,37 @@ def smart_generate_cards(page_index, page_image_bytes, config, max_cards=None, c
     return data
 
 
+def _map_crop_occlusions(data, regions):
+    """Turn figure-relative occlusions into page-relative ones, in place.
+
+    regions are the (left, top, width, height) page fractions of the figure
+    crops, in the order they were sent. An image_occlusion card names its
+    figure (1-based) in "figure"; it may be left out when there is only one.
+    Cards with an unknown figure lose their occlusions, so validation drops them.
+    """
+    for card in data.get("cards", []):
+        if card.get("type") != "image_occlusion":
+            continue
+        figure = card.pop("figure", None)
+        if figure is None and len(regions) == 1:
+            figure = 1
+        try:
+            index = int(figure)
+        except (TypeError, ValueError):
+            index = 0
+        # Negative indexes would silently pick a crop from the end
+        if not 1 <= index <= len(regions):
+            card["occlusions"] = []
+            continue
+        left, top, width, height = regions[index - 1]
+        for occ in card.get("occlusions", []):
+            if all(k in occ for k in ("left", "top", "width", "height")):
+                occ["left"] = left + occ["left"] * width
+                occ["top"] = top + occ["top"] * height
+                occ["width"] = occ["width"] * width
+                occ["height"] = occ["height"] * height
+
+
 def _display_generated_cards(data, display_page, model, from_cache):
     table = Table(show_header=True, header_style="bold", pad_edge=False, box=None)
     table.add_column("#", width=3)
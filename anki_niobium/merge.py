@@ -0,0 +1,103 @@
+"""
+Niobium merge — group nearby OCR boxes into single occlusions.
+
+Boxes are merged in one sweep in order of their top edge, as the original
+sequential merge did: each box is merged into the first earlier merged box
+it is close to, overlaps or touches, and that merged box then grows and
+moves to the end of the list. Only the merged boxes that a box can still
+reach are kept in NumPy arrays, so each box is tested against a small
+window in one vectorized step. The pairwise rule is the one
+niobium.calc_sim, does_intersect and does_touch implement.
+"""
+
+import numpy as np
+
+
+def _matches(g, r, gb, rb, threshold, tolerance):
+    """Vectorized calc_sim / does_intersect / does_touch of one box against many.
+
+    g holds (xmin, ymin, xmax, ymax) over all four corners, r holds the
+    corners the intersect/touch tests read: TL x, TL y, TR x, BR x, BR y.
+    gb / rb are the same rows for the single box.
+    """
+    x_dist = np.min(np.abs(g[:, [0, 0, 2, 2]] - gb[[0, 2, 0, 2]]), axis=1)
+    y_dist = np.min(np.abs(g[:, [1, 1, 3, 3]] - gb[[1, 3, 1, 3]]), axis=1)
+    close = (np.floor(x_dist) < threshold[0]) & (np.floor(y_dist) < threshold[1])
+
+    tl_x, tl_y, tr_x, br_x, br_y = r.T
+    b_tl_x, b_tl_y, b_tr_x, b_br_x, b_br_y = rb
+    intersect = ~((tr_x < b_tl_x) | (b_tr_x < tl_x)) & ~((br_y < b_tl_y) | (b_br_y < tl_y))
+    h_overlap = (tl_x <= b_br_x) & (b_tl_x <= br_x)
+    v_overlap = (tl_y <= b_br_y) & (b_tl_y <= br_y)
+    touch = (
+        h_overlap & ((np.abs(br_y - b_tl_y) <= tolerance) | (np.abs(b_br_y - tl_y) <= tolerance))
+    ) | (
+        v_overlap & ((np.abs(br_x - b_tl_x) <= tolerance) | (np.abs(b_br_x - tl_x) <= tolerance))
+    )
+    return close | intersect | touch
+
+
+def _rows(bbox):
+    """The g and r rows (see _matches) of a [TL, TR, BR, BL] box."""
+    c = np.asarray(bbox, dtype=float)
+    return (
+        np.array([c[:, 0].min(), c[:, 1].min(), c[:, 0].max(), c[:, 1].max()]),
+        np.array([c[0, 0], c[0, 1], c[1, 0], c[2, 0], c[2, 1]]),
+    )
+
+
+def merge_boxes(results, threshold=(20, 20), tolerance=2):
+    """Merge OCR results whose boxes are close, overlapping or touching.
+
+    Boxes are taken in order of their top-left y. A box is merged into the
+    first merged box (in list order) that has some pair of x edges closer
+    than threshold[0] and some pair of y edges closer than threshold[1]
+    (calc_sim), or that it intersects, or touches within tolerance pixels.
+    The merged box spans both boxes' corners, its text is the new box's
+    text followed by the old one and its prob their maximum; it moves to
+    the end of the list. A box matching nothing is appended unchanged.
+    This is the original sequential merge, result for result.
+    """
+    if len(results) == 0:
+        return []
+    results = sorted(results, key=lambda x: x[0][0][1])
+    n = len(results)
+
+    # floor(dist) < t holds for every dist < floor(t) + 1
+    pad_y = max(np.floor(threshold[1]) + 1, tolerance)
+    # Lowest top edge of every box from position i on: a merged box whose
+    # bottom lies further than pad_y above it can not match any more
+    tops = np.array([np.asarray(bbox, dtype=float)[:, 1].min() for bbox, _, _ in results])
+    reach = np.minimum.accumulate(tops[::-1])[::-1] - pad_y
+
+    # Every box creates at most one merged box
+    g = np.empty((n, 4))
+    r = np.empty((n, 5))
+    entries = []  # (bbox, text, prob) per merged box, by creation; None once merged again
+    active = np.empty(0, dtype=int)  # reachable merged boxes, in list order
+
+    for i, (bbox1, text1, prob1) in enumerate(results):
+        gb, rb = _rows(bbox1)
+        active = active[g[active, 3] >= reach[i]]
+        hit = np.flatnonzero(_matches(g[active], r[active], gb, rb, threshold, tolerance)) if len(active) else []
+        if len(hit):
+            j = int(active[hit[0]])
+            bbox2, text2, prob2 = entries[j]
+            entry = ([
+                [int(min(bbox1[0][0], bbox2[0][0])), int(min(bbox1[0][1], bbox2[0][1]))],
+                [int(max(bbox1[1][0], bbox2[1][0])), int(min(bbox1[1][1], bbox2[1][1]))],
+                [int(max(bbox1[2][0], bbox2[2][0])), int(max(bbox1[2][1], bbox2[2][1]))],
+                [int(min(bbox1[3][0], bbox2[3][0])), int(max(bbox1[3][1], bbox2[3][1]))],
+            ], text1 + " " + text2, max(prob1, prob2))
+            entries[j] = None
+            active = np.delete(active, hit[0])
+            gb, rb = _rows(entry[0])
+        else:
+            entry = (bbox1, text1, prob1)
+        k = len(entries)
+        entries.append(entry)
+        g[k], r[k] = gb, rb
+        active = np.append(active, k)
+
+    # The list keeps merged boxes in order of their last change, which is creation order
+    return [entry for entry in entries if entry is not None]
@@ -0,0 +1,328 @@
+"""
+Niobium OCR — process-wide EasyOCR reader registry.
+
+Loading the EasyOCR detection and recognition networks costs far more than
+running them on one image, so a Reader is created once per
+(languages, gpu flag, reader options) key and shared by every OCR path.
+"""
+
+import gc
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+from rich.console import Console
+from anki_niobium.theme import S
+
+console = Console()
+
+_readers = {}
+_timings = {"load": 0.0, "loads": 0, "inference": 0.0, "images": 0}
+
+# Worker pool for CPU-only batch runs (see start_pool). Each worker process
+# holds its own warm reader; the parent never loads one while a pool is up.
+_pool = None
+_pool_workers = 0
+
+# Batched images are padded (right/bottom, white) up to a multiple of this
+# many pixels so that similarly sized images can share one forward pass.
+# CRAFT pads to a multiple of 32 internally, and padding on the far edges
+# leaves box coordinates unchanged.
+_PAD_MULTIPLE = 64
+
+
+def _reader_key(langs, gpu, options=None):
+    """Normalize reader arguments into a hashable registry key.
+
+    langs may be a comma-separated string or a list. gpu is the config
+    device index; as before, only indices > 0 enable the GPU.
+    """
+    if isinstance(langs, str):
+        langs = langs.split(",")
+    langs = tuple(l.strip() for l in langs if l.strip())
+    return (langs, gpu > 0, tuple(sorted((options or {}).items())))
+
+
+def get_reader(langs, gpu, options=None):
+    """Return the shared Reader for this configuration, loading it on first use."""
+    key = _reader_key(langs, gpu, options)
+    reader = _readers.get(key)
+    if reader is None:
+        from easyocr import Reader
+        lang_list, use_gpu, opts = key
+        t0 = time.perf_counter()
+        reader = Reader(list(lang_list), gpu=use_gpu, verbose=False, **dict(opts))
+        elapsed = time.perf_counter() - t0
+        _timings["load"] += elapsed
+        _timings["loads"] += 1
+        console.print(
+            f"[{S.muted}]EasyOCR model loaded ({','.join(lang_list)}, "
+            f"{'GPU' if use_gpu else 'CPU'}) in {elapsed:.2f}s[/{S.muted}]"
+        )
+        _readers[key] = reader
+    return reader
+
+
+def warm_up(langs, gpu, options=None, workers=1):
+    """Load the reader up front so the first image does not pay the model load.
+
+    With workers > 1, start a process pool instead; every worker warms its
+    own reader.
+    """
+    if workers > 1:
+        start_pool(workers, langs, gpu, options)
+        return None
+    return get_reader(langs, gpu, options)
+
+
+def _worker_init(langs, gpu, options, torch_threads):
+    """Pool initializer: cap intra-op threads, then load this worker's reader."""
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass
+    try:
+        import cv2
+        cv2.setNumThreads(1)
+    except ImportError:
+        pass
+    get_reader(langs, gpu, options)
+
+
+def _worker_readtext(arrays, langs, gpu, options, batch_size):
+    """Pool task: OCR one chunk and report inference time plus any model load not yet reported."""
+    t0 = time.perf_counter()
+    results = _readtext_local(arrays, langs, gpu, options, batch_size)
+    elapsed = time.perf_counter() - t0
+    load, _timings["load"] = _timings["load"], 0.0
+    return results, elapsed, load
+
+
+def start_pool(workers, langs, gpu, options=None):
+    """Start a pool of OCR worker processes, splitting the CPU cores between them."""
+    global _pool, _pool_workers
+    if _pool is not None:
+        return
+    torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    console.print(f"[{S.muted}]Starting {workers} OCR workers ({torch_threads} thread(s) each)[/{S.muted}]")
+    _pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_worker_init,
+        initargs=(langs, gpu, options, torch_threads),
+    )
+    _pool_workers = workers
+
+
+def shutdown_pool():
+    global _pool, _pool_workers
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+        _pool_workers = 0
+
+
+def release(langs=None, gpu=None, options=None):
+    """Drop a cached reader, or every reader (and the worker pool) when called without arguments."""
+    if langs is None:
+        shutdown_pool()
+        _readers.clear()
+    else:
+        _readers.pop(_reader_key(langs, gpu, options), None)
+    gc.collect()
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    except ImportError:
+        pass
+
+
+def _record_inference(elapsed, n_images):
+    first = _timings["images"] == 0
+    _timings["inference"] += elapsed
+    _timings["images"] += n_images
+    if first and _pool is None:
+        console.print(
+            f"[{S.muted}]OCR startup: model load {_timings['load']:.2f}s "
+            f"vs first {'image' if n_images == 1 else f'batch of {n_images}'} {elapsed:.2f}s[/{S.muted}]"
+        )
+
+
+def _pad_to(array, height, width):
+    h, w = array.shape[:2]
+    if (h, w) == (height, width):
+        return array
+    padded = np.full((height, width) + array.shape[2:], 255, dtype=array.dtype)
+    padded[:h, :w] = array
+    return padded
+
+
+def readtext_batch(images, langs, gpu, options=None, batch_size=1):
+    """OCR a list of RGB numpy arrays, returning one result list per image in input order.
+
+    Images are bucketed by size (rounded up to _PAD_MULTIPLE); buckets with
+    more than one image go through EasyOCR's batched path, singletons through
+    the regular readtext call. batch_size is also used as the recognizer
+    batch size.
+    """
+    if not images:
+        return []
+    t0 = time.perf_counter()
+    results = _readtext_local(images, langs, gpu, options, batch_size)
+    _record_inference(time.perf_counter() - t0, len(images))
+    return results
+
+
+def readtext_stream(chunks, langs, gpu, options=None, batch_size=1, workers=1):
+    """OCR an iterable of (tag, arrays) chunks, yielding (tag, results) in input order.
+
+    The reader (or, with workers > 1, the worker pool) is warmed on the first
+    chunk that has anything to OCR, so fully cached runs never load the model.
+    On the pool at most two chunks per worker are in flight so decoded images
+    do not pile up.
+    """
+    in_flight = deque()
+    for tag, arrays in chunks:
+        if arrays:
+            warm_up(langs, gpu, options, workers)
+        if arrays and _pool is not None:
+            pending = _pool.submit(_worker_readtext, arrays, langs, gpu, options, batch_size)
+        else:
+            pending = readtext_batch(arrays, langs, gpu, options, batch_size)
+        in_flight.append((tag, len(arrays), pending))
+        while in_flight and (len(in_flight) > 2 * workers or not isinstance(in_flight[0][2], Future)):
+            yield _collect(in_flight.popleft())
+    while in_flight:
+        yield _collect(in_flight.popleft())
+
+
+def _collect(entry):
+    tag, n_images, pending = entry
+    if not isinstance(pending, Future):
+        return tag, pending
+    results, elapsed, load = pending.result()
+    if load:
+        _timings["load"] += load
+        _timings["loads"] += 1
+    _record_inference(elapsed, n_images)
+    return tag, results
+
+
+def _readtext_local(images, langs, gpu, options, batch_size):
+    reader = get_reader(langs, gpu, options)
+    buckets = {}
+    for i, arr in enumerate(images):
+        h, w = arr.shape[:2]
+        key = (-(-h // _PAD_MULTIPLE) * _PAD_MULTIPLE, -(-w // _PAD_MULTIPLE) * _PAD_MULTIPLE)
+        buckets.setdefault(key, []).append(i)
+
+    results = [None] * len(images)
+    for (height, width), idxs in buckets.items():
+        if len(idxs) == 1:
+            results[idxs[0]] = reader.readtext(images[idxs[0]], batch_size=batch_size)
+            continue
+        batch = [_pad_to(images[i], height, width) for i in idxs]
+        for i, res in zip(idxs, reader.readtext_batched(batch, batch_size=batch_size)):
+            results[i] = res
+    return results
+
+
+# ── Pre-OCR downscaling and tiling ───────────────────────────────────
+
+def plan_views(width, height, max_edge=0, tile_aspect=0, tile_overlap=0.1):
+    """Plan the views OCR should see of a width x height image.
+
+    Returns (scale, tiles). scale shrinks the image so its long edge fits
+    max_edge — or, for captures longer than tile_aspect:1, so its short edge
+    does. tiles is a list of (x0, y0, x1, y1, core) rectangles in original
+    pixels; core = (lo, hi) is the span along the long axis whose box centres
+    the tile owns, so text in the overlap between tiles is kept exactly once.
+    All tiles of an image have the same size and therefore batch together.
+    """
+    long_edge, short_edge = max(width, height), min(width, height)
+    tiled = bool(tile_aspect) and long_edge > short_edge * tile_aspect
+    limit = short_edge if tiled else long_edge
+    scale = min(1.0, max_edge / limit) if max_edge else 1.0
+    everything = (float("-inf"), float("inf"))
+    if not tiled:
+        return scale, [(0, 0, width, height, everything)]
+
+    tile_len = short_edge * tile_aspect
+    if max_edge:
+        tile_len = min(tile_len, max_edge / scale)
+    tile_len = int(tile_len)
+    step = max(1, int(tile_len * (1 - tile_overlap)))
+    starts = list(range(0, long_edge - tile_len, step)) + [long_edge - tile_len]
+
+    tiles = []
+    for k, start in enumerate(starts):
+        lo = everything[0] if k == 0 else (starts[k - 1] + tile_len + start) / 2
+        hi = everything[1] if k == len(starts) - 1 else (start + tile_len + starts[k + 1]) / 2
+        if height >= width:
+            tiles.append((0, start, width, start + tile_len, (lo, hi)))
+        else:
+            tiles.append((start, 0, start + tile_len, height, (lo, hi)))
+    return scale, tiles
+
+
+def draft(image, width, height, scale):
+    """Ask the JPEG decoder for a reduced-size decode (1/2, 1/4, 1/8) when shrinking.
+
+    Only has an effect on JPEG files that have not been loaded yet; the
+    decoder never goes below the requested size. image is reduced in place,
+    so pass one opened for OCR alone.
+    """
+    if scale < 1.0 and getattr(image, "format", None) == "JPEG":
+        image.draft("RGB", (max(1, int(width * scale)), max(1, int(height * scale))))
+
+
+def render_views(image, width, height, scale, tiles):
+    """Cut the planned tiles out of image and resize them for OCR.
+
+    image may be a reduced JPEG draft of the width x height original.
+    Returns (arrays, transforms); pass the transforms to map_results.
+    """
+    rgb = image.convert("RGB")
+    dx, dy = rgb.size[0] / width, rgb.size[1] / height
+    arrays, transforms = [], []
+    for x0, y0, x1, y1, core in tiles:
+        view = rgb
+        if (x0, y0, x1, y1) != (0, 0, width, height):
+            view = rgb.crop((round(x0 * dx), round(y0 * dy), round(x1 * dx), round(y1 * dy)))
+        target = (max(1, round((x1 - x0) * scale)), max(1, round((y1 - y0) * scale)))
+        if view.size != target:
+            view = view.resize(target, reducing_gap=3.0)
+        arrays.append(np.asarray(view))
+        transforms.append((target[0] / (x1 - x0), target[1] / (y1 - y0), x0, y0, core))
+    return arrays, transforms
+
+
+def map_results(view_results, transforms, vertical):
+    """Map per-view OCR results back to original-image pixel coordinates."""
+    if len(transforms) == 1 and transforms[0][:4] == (1.0, 1.0, 0, 0):
+        return view_results[0]
+    axis = 1 if vertical else 0
+    merged = []
+    for results, (sx, sy, x0, y0, (lo, hi)) in zip(view_results, transforms):
+        for bbox, text, prob in results:
+            pts = [[int(round(x / sx + x0)), int(round(y / sy + y0))] for x, y in bbox]
+            centre = sum(p[axis] for p in pts) / len(pts)
+            if lo <= centre < hi:
+                merged.append((pts, text, prob))
+    return merged
+
+
+def print_timing_summary():
+    """Print total model-load cost versus per-image inference cost for this run."""
+    n = _timings["images"]
+    if not n and not _timings["loads"]:
+        return
+    per_image = _timings["inference"] / n if n else 0.0
+    console.print(
+        f"[{S.muted}]OCR timing: model load {_timings['load']:.2f}s ({_timings['loads']} load(s)) "
+        f"| inference {_timings['inference']:.2f}s over {n} image(s), {per_image:.2f}s/image[/{S.muted}]"
+    )
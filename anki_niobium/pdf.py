@@ -0,0 +1,215 @@
+"""
+Niobium PDF session — open the input PDF once per run.
+
+The page count, --page label resolution and every stage that reads pages
+(smart generation, image occlusion, image extraction) need the document.
+PdfSession opens it once, keeps the page count, labels and per-page
+fingerprints, and is handed to each stage. Stages also accept a plain path, which is
+then opened for that call only (see open_pdf). Worker processes still
+open their own handle from PdfSession.path.
+
+The document handle is not thread-safe: a stage that reads pages in a
+background thread (e.g. pdf.lookahead) must be the only reader meanwhile.
+"""
+
+import hashlib
+from contextlib import contextmanager
+
+import fitz
+
+
+# Keys left out of an object's digest: links back up to a page, the page
+# tree or the structure tree and an annotation's popup are not content;
+# stream lengths and filters describe the encoding, the decoded stream is hashed
+_IGNORED_KEYS = {
+    "/Parent", "/P", "/Popup", "/StructParent", "/StructParents",
+    "/Length", "/Filter", "/DecodeParms", "/DL",
+}
+_DELIMITERS = set("()<>[]{}/%")
+
+
+def _tokens(source):
+    """Tokens of PDF object source: delimiters, names, strings, numbers and keywords."""
+    i, n = 0, len(source)
+    while i < n:
+        c = source[i]
+        if c.isspace():
+            i += 1
+        elif c == "%":
+            while i < n and source[i] not in "\r\n":
+                i += 1
+        elif source.startswith("<<", i) or source.startswith(">>", i):
+            yield source[i:i + 2]
+            i += 2
+        elif c in "[]{}":
+            yield c
+            i += 1
+        elif c == "<":
+            j = source.index(">", i)
+            yield "<" + "".join(source[i + 1:j].split()).lower() + ">"
+            i = j + 1
+        elif c == "(":
+            j, depth = i + 1, 1
+            while depth:
+                if source[j] == "\\":
+                    j += 1
+                elif source[j] == "(":
+                    depth += 1
+                elif source[j] == ")":
+                    depth -= 1
+                j += 1
+            yield source[i:j]
+            i = j
+        else:
+            j = i + 1
+            while j < n and not source[j].isspace() and source[j] not in _DELIMITERS:
+                j += 1
+            yield source[i:j]
+            i = j
+
+
+def _parse(tokens, k=0):
+    """Parse the object starting at tokens[k]; returns (value, next k).
+
+    Dictionaries become dicts, arrays lists, indirect references
+    ("ref", xref) tuples and everything else its token.
+    """
+    t = tokens[k]
+    if t == "<<":
+        value, k = {}, k + 1
+        while tokens[k] != ">>":
+            value[tokens[k]], k = _parse(tokens, k + 1)
+        return value, k + 1
+    if t == "[":
+        value, k = [], k + 1
+        while tokens[k] != "]":
+            item, k = _parse(tokens, k)
+            value.append(item)
+        return value, k + 1
+    if t.isdigit() and k + 2 < len(tokens) and tokens[k + 1].isdigit() and tokens[k + 2] == "R":
+        return ("ref", int(t)), k + 3
+    return t, k + 1
+
+
+class PdfSession:
+    """An open PDF with its page count, page labels and page fingerprints."""
+
+    def __init__(self, path):
+        self.path = path
+        self.doc = fitz.Document(path)
+        self.page_count = self.doc.page_count
+        self._labels = None
+        self._label_index = None
+        self._fingerprints = {}
+        self._xref_digests = {}
+
+    def __fspath__(self):
+        return self.path
+
+    @property
+    def labels(self):
+        """User-visible label of every page; the 1-based page number where the PDF defines none."""
+        if self._labels is None:
+            if self.doc.get_page_labels():
+                self._labels = [self.doc[i].get_label() or str(i + 1) for i in range(self.page_count)]
+            else:
+                self._labels = [str(i + 1) for i in range(self.page_count)]
+        return self._labels
+
+    def get_page_numbers(self, label, only_one=False):
+        """Page indices carrying label, like fitz.Document.get_page_numbers, from a map built once."""
+        if self._label_index is None:
+            self._label_index = {}
+            if self.doc.get_page_labels():
+                for i, page_label in enumerate(self.labels):
+                    self._label_index.setdefault(page_label, []).append(i)
+        hits = self._label_index.get(label, [])
+        return hits[:1] if only_one else list(hits)
+
+    def page_fingerprint(self, i):
+        """sha256 of what page i draws, computed without rendering it.
+
+        Covers the page size and rotation, its content streams, its
+        resources and its annotations. Objects the page refers to (images,
+        soft masks, fonts and their font files, color spaces, forms) are
+        hashed by content, recursively, in place of their object numbers.
+        A page therefore keeps its fingerprint when other pages of the PDF
+        change, are added or removed, also when the file is written again
+        and its objects are renumbered.
+        """
+        if i not in self._fingerprints:
+            page = self.doc.load_page(i)
+            h = hashlib.sha256(f"{tuple(page.mediabox)}:{tuple(page.cropbox)}:{page.rotation}\n".encode("utf-8"))
+            h.update(page.read_contents())
+            h.update(self._canonical(self._resources(page.xref), set()))
+            for annot in page.annots():
+                if annot.type[1] != "Popup":
+                    h.update(self._object_digest(annot.xref, set()))
+            self._fingerprints[i] = h.hexdigest()
+        return self._fingerprints[i]
+
+    def _resources(self, xref):
+        """Source of the /Resources of page xref, inherited from the page tree when the page has none."""
+        while xref:
+            kind, value = self.doc.xref_get_key(xref, "Resources")
+            if kind != "null":
+                return value
+            kind, parent = self.doc.xref_get_key(xref, "Parent")
+            xref = int(parent.split()[0]) if kind == "xref" else 0
+        return ""
+
+    def _canonical(self, source, visiting):
+        """Object source in a form independent of object numbers and key order.
+
+        Dictionary keys are sorted, _IGNORED_KEYS dropped and every indirect
+        reference replaced by the digest of the object it points to.
+        """
+        tokens = list(_tokens(source))
+        return self._serialize(_parse(tokens)[0], visiting).encode("utf-8") if tokens else b""
+
+    def _serialize(self, value, visiting):
+        if isinstance(value, dict):
+            items = (f"{key} {self._serialize(value[key], visiting)}" for key in sorted(value) if key not in _IGNORED_KEYS)
+            return "<<" + " ".join(items) + ">>"
+        if isinstance(value, list):
+            return "[" + " ".join(self._serialize(item, visiting) for item in value) + "]"
+        if isinstance(value, tuple):
+            return "<" + self._object_digest(value[1], visiting).hex() + ">"
+        return value
+
+    def _object_digest(self, xref, visiting):
+        """sha256 of object xref by content: its canonical source, plus the decoded stream for streams."""
+        if xref in self._xref_digests:
+            return self._xref_digests[xref]
+        if xref in visiting or not 0 < xref < self.doc.xref_length():
+            # A reference cycle, or a dangling reference
+            return b"ref"
+        if self.doc.xref_get_key(xref, "Type") == ("name", "/Page"):
+            # Links to other pages: their content is not part of this page
+            return b"page"
+        visiting.add(xref)
+        h = hashlib.sha256(self._canonical(self.doc.xref_object(xref, compressed=True), visiting))
+        if self.doc.xref_is_stream(xref):
+            h.update(self.doc.xref_stream(xref))
+        visiting.discard(xref)
+        self._xref_digests[xref] = h.digest()
+        return self._xref_digests[xref]
+
+    def close(self):
+        self.doc.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@contextmanager
+def open_pdf(pdf):
+    """Yield a PdfSession for pdf: a session as it is, a path opened for the block."""
+    if isinstance(pdf, PdfSession):
+        yield pdf
+        return
+    with PdfSession(pdf) as session:
+        yield session
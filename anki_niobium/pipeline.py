@@ -0,0 +1,144 @@
+"""
+Niobium pipeline — overlap the stages of a batch run.
+
+A source iterable (e.g. the OCR stream) is drained by a producer thread and
+pushed through stages connected by bounded queues, each stage with its own
+number of worker threads. Results come back in input order, so the caller
+can deliver them (AnkiConnect / genanki) deterministically while the next
+items are still being OCR'd and filtered. Full queues block the stage
+upstream of them, and the producer stops reading the source while
+queue_size + workers items are in flight (read but not yet delivered in
+order), so one slow item cannot make finished later ones pile up: memory
+stays bounded.
+"""
+
+import queue
+import threading
+
+_STOP = object()
+
+
+class _Failure:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+class Pipeline:
+    """Run items from a source through threaded stages with backpressure.
+
+    stages is a list of (name, fn, workers) tuples; each fn takes one item
+    and returns the item for the next stage. With no stages, run() only
+    prefetches: the source is read ahead in a background thread, up to
+    queue_size items.
+    """
+
+    def __init__(self, stages, queue_size=4):
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+
+    def run(self, source):
+        """Yield the output of the last stage for every source item, in input order."""
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        cancel = threading.Event()
+        threads = []
+        # Items read from the source and not yet yielded, including those
+        # finished out of order and waiting for an earlier one
+        in_flight = threading.Semaphore(self.queue_size + sum(workers for _, _, workers in self.stages))
+
+        def _put(q, entry):
+            while not cancel.is_set():
+                try:
+                    q.put(entry, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        items = iter(source)
+
+        def _produce():
+            try:
+                for seq, item in enumerate(items):
+                    while not in_flight.acquire(timeout=0.1):
+                        if cancel.is_set():
+                            return
+                    if not _put(queues[0], (seq, item)):
+                        return
+            except BaseException as e:
+                _put(queues[-1], (-1, _Failure(e)))
+            finally:
+                # A generator can only be closed by the thread running it; closing
+                # runs its cleanup (e.g. shutting down a process pool) on cancel too
+                close = getattr(items, "close", None)
+                if close is not None:
+                    close()
+                for _ in range(self.stages[0][2] if self.stages else 1):
+                    _put(queues[0], _STOP)
+
+        def _work(k, fn, remaining, lock):
+            q_in, q_out = queues[k], queues[k + 1]
+            while True:
+                try:
+                    entry = q_in.get(timeout=0.1)
+                except queue.Empty:
+                    if cancel.is_set():
+                        return
+                    continue
+                if entry is _STOP:
+                    break
+                seq, item = entry
+                try:
+                    result = fn(item)
+                except BaseException as e:
+                    _put(queues[-1], (seq, _Failure(e)))
+                    continue
+                if not _put(q_out, (seq, result)):
+                    break
+            # The last worker of a stage to finish stops the next stage
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                n_next = self.stages[k + 1][2] if k + 1 < len(self.stages) else 1
+                for _ in range(n_next):
+                    _put(q_out, _STOP)
+
+        threads.append(threading.Thread(target=_produce, name="pipeline-source", daemon=True))
+        for k, (name, fn, workers) in enumerate(self.stages):
+            remaining, lock = [workers], threading.Lock()
+            for w in range(workers):
+                threads.append(threading.Thread(
+                    target=_work, args=(k, fn, remaining, lock), name=f"pipeline-{name}-{w}", daemon=True,
+                ))
+        for t in threads:
+            t.start()
+
+        pending = {}
+        next_seq = 0
+        out = queues[-1]
+        try:
+            while True:
+                entry = out.get()
+                if entry is _STOP:
+                    break
+                seq, result = entry
+                if isinstance(result, _Failure):
+                    raise result.exc
+                pending[seq] = result
+                while next_seq in pending:
+                    result = pending.pop(next_seq)
+                    next_seq += 1
+                    in_flight.release()
+                    yield result
+        finally:
+            cancel.set()
+            # Unblock pending puts and drop buffered items, then wait for the
+            # threads, so the source is closed before run() returns
+            for q in queues:
+                while True:
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        break
+            for t in threads:
+                t.join()
@@ -0,0 +1,229 @@
+"""
+Niobium rate limiting — pace and retry Claude requests across threads.
+
+Smart mode sends many requests, several at a time (llm.concurrency). All
+of them go through one RequestScheduler, which
+
+- holds token buckets for requests/min and input tokens/min, so requests
+  wait for capacity instead of running into 429s. Limits come from
+  llm.rate_limit, or are learned from the API's rate-limit headers, which
+  also tell how much of them is left;
+- retries failed requests with jittered exponential backoff, honouring
+  retry-after, with a retry budget per error class (llm.retry). A 429
+  pauses every thread, not only the one that got it;
+- settles the input-token bucket with the usage Claude reports, so
+  estimates that were too low or too high do not accumulate.
+"""
+
+import random
+import threading
+import time
+
+import anthropic
+from rich.console import Console
+
+from anki_niobium.theme import S
+
+console = Console()
+
+# Retries per error class; 0 lets the error through at once. Errors of
+# other classes (bad request, authentication, ...) are never retried.
+RETRY_POLICY = {
+    "rate_limit": 8,      # 429: the account's rate limits were exceeded
+    "overloaded": 6,      # 529: the API is temporarily overloaded
+    "server_error": 3,    # other 5xx
+    "connection": 3,      # timeouts, dropped connections
+    "backoff_base": 1.0,  # seconds before the first retry, doubled per attempt
+    "backoff_max": 60.0,
+}
+
+# Rate-limit headers of a Messages response: bucket -> (limit, remaining) header
+_LIMIT_HEADERS = {
+    "requests": ("anthropic-ratelimit-requests-limit", "anthropic-ratelimit-requests-remaining"),
+    "input_tokens": ("anthropic-ratelimit-input-tokens-limit", "anthropic-ratelimit-input-tokens-remaining"),
+}
+
+# Error classes of requests the server did not accept; their charge is refunded
+_NOT_ACCEPTED = {"rate_limit", "overloaded", "connection"}
+
+
+class _Bucket:
+    """Token bucket refilled continuously at per_minute / 60 per second."""
+
+    def __init__(self, per_minute, level=None):
+        self.capacity = float(per_minute)
+        self.level = self.capacity if level is None else min(self.capacity, float(level))
+        self.stamp = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.stamp) * self.capacity / 60)
+        self.stamp = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount (at most the capacity) is available."""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing * 60 / self.capacity)
+
+    def take(self, amount):
+        self.level -= amount
+
+    def refund(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+
+def error_class(exc):
+    """Retry class of an API exception (a RETRY_POLICY key), or None if it is not retried."""
+    if isinstance(exc, anthropic.APIConnectionError):
+        return "connection"
+    if isinstance(exc, anthropic.APIStatusError):
+        if exc.status_code == 429:
+            return "rate_limit"
+        if exc.status_code == 529:
+            return "overloaded"
+        if exc.status_code >= 500:
+            return "server_error"
+    return None
+
+
+def _retry_after(exc):
+    """Seconds from the retry-after header of a failed response, or None."""
+    response = getattr(exc, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RequestScheduler:
+    """Paces and retries Messages requests for all threads of a run.
+
+    requests_per_minute / input_tokens_per_minute of None are learned from
+    the rate-limit headers of the first response; until then requests are
+    only limited by llm.concurrency. retry overrides RETRY_POLICY entries.
+    """
+
+    def __init__(self, requests_per_minute=None, input_tokens_per_minute=None, retry=None):
+        self.policy = {**RETRY_POLICY, **(retry or {})}
+        self._buckets = {}
+        self._learn = set()
+        for name, limit in (("requests", requests_per_minute), ("input_tokens", input_tokens_per_minute)):
+            if limit:
+                self._buckets[name] = _Bucket(limit)
+            else:
+                self._learn.add(name)
+        self._pause_until = 0.0
+        self._lock = threading.Lock()
+
+    def _acquire(self, input_tokens, charge=True):
+        """Block until the buckets (and any 429 pause) allow one request of input_tokens.
+
+        With charge, the request is taken from the buckets and the charged
+        buckets are returned (for _refund); without, only the pause is waited
+        out, the buckets are left alone and {} is returned.
+        """
+        wanted = {"requests": 1, "input_tokens": input_tokens}
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                waits = [self._pause_until - now]
+                if charge:
+                    waits += [bucket.wait_time(wanted[name], now) for name, bucket in self._buckets.items()]
+                wait = max(waits)
+                if wait <= 0:
+                    if not charge:
+                        return {}
+                    for name, bucket in self._buckets.items():
+                        bucket.take(wanted[name])
+                    return {name: (bucket, wanted[name]) for name, bucket in self._buckets.items()}
+            # Wake up early: settled usage may return capacity sooner
+            time.sleep(min(wait, 0.25))
+
+    def _refund(self, charged):
+        """Give back what _acquire charged for a request the server did not accept."""
+        with self._lock:
+            for bucket, amount in charged.values():
+                bucket.refund(amount)
+
+    def _settle(self, estimate, usage):
+        """Charge the input-token bucket the difference between reported and estimated tokens."""
+        bucket = self._buckets.get("input_tokens")
+        if bucket is None or usage is None:
+            return
+        # Prompt cache reads do not count towards the input-token limit
+        actual = usage.input_tokens + (getattr(usage, "cache_creation_input_tokens", None) or 0)
+        with self._lock:
+            bucket.take(actual - estimate)
+
+    def _learn_limits(self, headers):
+        if not self._learn:
+            return
+        with self._lock:
+            for name in list(self._learn):
+                limit_header, remaining_header = _LIMIT_HEADERS[name]
+                try:
+                    limit = float(headers.get(limit_header) or 0)
+                    remaining = headers.get(remaining_header)
+                    remaining = float(remaining) if remaining is not None else None
+                except ValueError:
+                    limit, remaining = 0, None
+                if limit > 0:
+                    # Other requests (other runs, other clients of the key) may already have used some
+                    self._buckets[name] = _Bucket(limit, remaining)
+                    self._learn.discard(name)
+
+    def _backoff(self, exc, attempt):
+        """Seconds to wait before retry number attempt + 1: retry-after if given, else jittered exponential."""
+        delay = _retry_after(exc)
+        if delay is None:
+            ceiling = min(self.policy["backoff_max"], self.policy["backoff_base"] * 2 ** attempt)
+            delay = random.uniform(ceiling / 2, ceiling)
+        return delay
+
+    def create(self, client, params, input_tokens, label=None):
+        """Send a Messages request through the buckets, retrying it by error class.
+
+        input_tokens is an estimate of the request's input tokens. The SDK's
+        own retries are turned off; the scheduler does them. A request is
+        charged to the buckets once: attempts the server did not accept
+        (429, 529, connection errors) are refunded and charged again when
+        retried, and retries after other errors only wait. Returns the
+        Message; raises the last error when it is not retried or the retry
+        budget of its class is used up.
+        """
+        client = client.with_options(max_retries=0)
+        attempts = {}
+        charged = None
+        while True:
+            if charged is None:
+                charged = self._acquire(input_tokens)
+            else:
+                self._acquire(input_tokens, charge=False)
+            try:
+                raw = client.messages.with_raw_response.create(**params)
+            except Exception as e:
+                kind = error_class(e)
+                if kind in _NOT_ACCEPTED:
+                    self._refund(charged)
+                    charged = None
+                tries = attempts.get(kind, 0)
+                if kind is None or tries >= self.policy[kind]:
+                    raise
+                attempts[kind] = tries + 1
+                delay = self._backoff(e, sum(attempts.values()) - 1)
+                if kind == "rate_limit":
+                    # Every thread would hit the same limit; hold them all
+                    with self._lock:
+                        self._pause_until = max(self._pause_until, time.monotonic() + delay)
+                prefix = f"{label}: " if label else ""
+                console.print(
+                    f"[{S.accent2}]{prefix}{kind.replace('_', ' ')} ({getattr(e, 'status_code', type(e).__name__)}), "
+                    f"retrying in {delay:.1f}s ({tries + 1}/{self.policy[kind]})[/{S.accent2}]"
+                )
+                time.sleep(delay)
+                continue
+            self._learn_limits(raw.headers)
+            message = raw.parse()
+            self._settle(input_tokens, getattr(message, "usage", None))
+            return message
@@ -0,0 +1,161 @@
+"""
+Local stand-in for the Anthropic Messages and Message Batches endpoints.
+
+Point llm.base_url at it to exercise smart mode and --batch without an
+API key or network access:
+
+    python tests/fake_anthropic.py 8722
+    # config: llm.base_url: http://127.0.0.1:8722, llm.batch_poll_interval: 0.2
+
+Live requests are answered at once. A batch reports "in_progress" until
+it has been polled polls_to_end times, then "ended" with one result per
+request. answer(params) returns the text of a request's response, or None
+to make that request fail; the default answers filter requests with no
+decisions and generation requests with one basic card.
+"""
+
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODEL = "claude-sonnet-4-6"
+
+
+def default_answer(params):
+    if "OCR-detected" in json.dumps(params["messages"]):
+        return json.dumps({"decisions": []})
+    return json.dumps({"cards": [{"type": "basic", "front": "Q", "back": "A"}]})
+
+
+def _message(text, model=MODEL):
+    return {
+        "id": "msg_fake", "type": "message", "role": "assistant", "model": model,
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn", "stop_sequence": None,
+        "usage": {"input_tokens": 1000, "output_tokens": 200},
+    }
+
+
+class FakeAnthropic:
+    """Serves the stand-in on 127.0.0.1:port (0 = any free port) from a background thread.
+
+    batches maps batch id -> {"requests": [...], "polls": n}; live holds
+    the params of every live Messages request.
+    """
+
+    def __init__(self, port=0, polls_to_end=2, answer=default_answer):
+        self.polls_to_end = polls_to_end
+        self.answer = answer
+        self.batches = {}
+        self.live = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _batch(self, batch_id):
+        requests = self.batches[batch_id]["requests"]
+        ended = self.batches[batch_id]["polls"] >= self.polls_to_end
+        succeeded = sum(self.answer(r["params"]) is not None for r in requests) if ended else 0
+        return {
+            "id": batch_id, "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {
+                "processing": 0 if ended else len(requests),
+                "succeeded": succeeded,
+                "errored": len(requests) - succeeded if ended else 0,
+                "canceled": 0, "expired": 0,
+            },
+            "created_at": "2026-01-01T00:00:00Z", "expires_at": "2026-01-02T00:00:00Z",
+            "ended_at": "2026-01-01T01:00:00Z" if ended else None,
+            "archived_at": None, "cancel_initiated_at": None,
+            "results_url": f"{self.url}/v1/messages/batches/{batch_id}/results" if ended else None,
+        }
+
+    def _results(self, batch_id):
+        lines = []
+        for request in self.batches[batch_id]["requests"]:
+            text = self.answer(request["params"])
+            if text is None:
+                result = {"type": "errored", "error": {"type": "error", "error": {"type": "api_error", "message": "fake failure"}}}
+            else:
+                result = {"type": "succeeded", "message": _message(text, request["params"]["model"])}
+            lines.append(json.dumps({"custom_id": request["custom_id"], "result": result}))
+        return "\n".join(lines).encode("utf-8")
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, body, content_type="application/json", status=200):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                data = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                path = self.path.split("?")[0]
+                if path == "/v1/messages/batches":
+                    with fake._lock:
+                        batch_id = f"msgbatch_{len(fake.batches) + 1:04d}"
+                        fake.batches[batch_id] = {"requests": data["requests"], "polls": 0}
+                        self._send(fake._batch(batch_id))
+                elif path == "/v1/messages":
+                    with fake._lock:
+                        fake.live.append(data)
+                    text = fake.answer(data)
+                    if text is None:
+                        self._send({"type": "error", "error": {"type": "invalid_request_error", "message": "fake failure"}},
+                                   status=400)
+                    else:
+                        self._send(_message(text, data["model"]))
+                else:
+                    self._send({"type": "error", "error": {"type": "not_found_error", "message": path}}, status=404)
+
+            def do_GET(self):
+                parts = self.path.split("?")[0].strip("/").split("/")
+                with fake._lock:
+                    if parts[:3] == ["v1", "messages", "batches"] and len(parts) >= 4 and parts[3] in fake.batches:
+                        batch_id = parts[3]
+                        if parts[4:] == ["results"]:
+                            return self._send(fake._results(batch_id), "application/binary")
+                        fake.batches[batch_id]["polls"] += 1
+                        return self._send(fake._batch(batch_id))
+                self._send({"type": "error", "error": {"type": "not_found_error", "message": self.path}}, status=404)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    server = FakeAnthropic(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8722)
+    print(f"Serving a stand-in Anthropic API at {server.url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
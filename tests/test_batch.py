@@ -0,0 +1,147 @@
+"""--batch against the local stand-in API (fake_anthropic): submit, poll, resume, chunking and the live fallback."""
+
+import inspect
+import json
+from io import BytesIO
+
+import anthropic
+import pytest
+from PIL import Image
+
+from anki_niobium import cache
+from anki_niobium.batch import BatchCollector
+from anki_niobium.cache import _execute, get_cached_claude_response
+from fake_anthropic import MODEL, FakeAnthropic, default_answer
+
+
+@pytest.fixture(autouse=True)
+def cache_db(tmp_path, monkeypatch):
+    """A fresh cache.db per test."""
+    monkeypatch.setattr(cache, "CACHE_DIR", tmp_path)
+    monkeypatch.setattr(cache, "CACHE_DB", tmp_path / "cache.db")
+    monkeypatch.setattr(cache, "_conn", None)
+    yield
+    if cache._conn is not None:
+        cache._conn.close()
+
+
+def _fail_marked(params):
+    """Fail every request whose prompt contains "FAIL"."""
+    return None if "FAIL" in json.dumps(params["messages"]) else default_answer(params)
+
+
+@pytest.fixture
+def server():
+    with FakeAnthropic(polls_to_end=2, answer=_fail_marked) as fake:
+        yield fake
+
+
+def _config(server):
+    return {"llm": {"api_key": "test", "base_url": server.url, "batch_poll_interval": 0}}
+
+
+def _add(collector, prompt):
+    cache_args = (f"hash-{prompt}", "[]", MODEL, None)
+    params = {"model": MODEL, "max_tokens": 16, "messages": [{"role": "user", "content": f"OCR-detected {prompt}"}]}
+    collector.add(cache_args, params)
+    return cache_args
+
+
+def _job_rows():
+    return _execute("SELECT batch_id, requests, status FROM batch_jobs ORDER BY batch_id")
+
+
+def test_submit_poll_and_cache(server):
+    collector = BatchCollector(_config(server))
+    keys = [_add(collector, prompt) for prompt in ("a", "b", "FAIL c")]
+
+    assert collector.run() == 2
+    assert len(server.batches) == 1
+    (batch,) = server.batches.values()
+    assert len(batch["requests"]) == 3
+    assert batch["polls"] >= 2
+    assert get_cached_claude_response(*keys[0]) == {"decisions": []}
+    assert get_cached_claude_response(*keys[1]) == {"decisions": []}
+    # Failed requests are left out of the cache for the second pass
+    assert get_cached_claude_response(*keys[2]) is None
+    assert _job_rows() == [("msgbatch_0001", 3, "ended")]
+
+
+def test_resume_interrupted_batch(server):
+    prompts = ("a", "b")
+    first = BatchCollector(_config(server))
+    for prompt in prompts:
+        _add(first, prompt)
+    # Submitted, then interrupted before the batch ended
+    first._submit(anthropic.Anthropic(api_key="test", base_url=server.url), sorted(first.requests), "")
+    assert _job_rows() == [("msgbatch_0001", 2, "in_progress")]
+
+    second = BatchCollector(_config(server))
+    keys = [_add(second, prompt) for prompt in prompts]
+    assert second.run() == 2
+    assert list(server.batches) == ["msgbatch_0001"]
+    assert all(get_cached_claude_response(*key) == {"decisions": []} for key in keys)
+    assert _job_rows() == [("msgbatch_0001", 2, "ended")]
+
+
+def test_ended_batch_is_submitted_again(server):
+    collector = BatchCollector(_config(server))
+    _add(collector, "FAIL a")
+    assert collector.run() == 0
+
+    again = BatchCollector(_config(server))
+    _add(again, "FAIL a")
+    again.run()
+    assert len(server.batches) == 2
+
+
+def test_chunks_under_request_limit(server):
+    collector = BatchCollector(_config(server), limits={"requests": 2})
+    keys = [_add(collector, prompt) for prompt in "abcde"]
+
+    assert collector.run() == 5
+    assert sorted(len(b["requests"]) for b in server.batches.values()) == [1, 2, 2]
+    # One job row per batch
+    assert [(requests, status) for _, requests, status in _job_rows()] == [(2, "ended"), (2, "ended"), (1, "ended")]
+    assert all(get_cached_claude_response(*key) is not None for key in keys)
+
+
+def test_chunks_under_size_limit(server):
+    collector = BatchCollector(_config(server), limits={"bytes": 600})
+    for prompt in "abcd":
+        _add(collector, prompt)
+    _add(collector, "x" * 1000)
+
+    # The oversized request is left for the second pass
+    assert collector.run() == 4
+    assert len(server.batches) > 1
+    for batch in server.batches.values():
+        assert len(json.dumps({"requests": batch["requests"]})) <= 600
+    assert sum(len(b["requests"]) for b in server.batches.values()) == 4
+
+
+@pytest.mark.skipif(
+    "temperature" not in inspect.signature(anthropic.resources.messages.Messages.create).parameters,
+    reason="installed anthropic SDK no longer accepts temperature",
+)
+def test_failed_request_sent_live(server):
+    from anki_niobium.llm import smart_filter_results
+
+    with BytesIO() as output:
+        Image.new("RGB", (64, 32), "white").save(output, format="PNG")
+        image = output.getvalue()
+    pages = [[([[0, 0], [10, 0], [10, 10], [0, 10]], text, 0.9)] for text in ("ok", "FAIL")]
+    config = _config(server)
+    collector = BatchCollector(config)
+
+    # Collect pass: every request goes to the batch
+    assert all(smart_filter_results(results, image, {**config, "_batch": collector}) is None for results in pages)
+    assert collector.run() == 1
+
+    # Second pass: the cached response is reused, the failed request is sent live
+    server.answer = default_answer
+    for results in pages:
+        filtered, _ = smart_filter_results(results, image, config)
+        assert filtered == results
+    assert len(server.live) == 1
+    assert "FAIL" in json.dumps(server.live[0]["messages"])
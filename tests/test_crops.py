@@ -0,0 +1,33 @@
+"""Mapping figure-relative occlusions from crop requests back onto the page."""
+
+import pytest
+
+from anki_niobium.llm import _map_crop_occlusions
+
+REGIONS = [(0.1, 0.2, 0.5, 0.4), (0.5, 0.5, 0.25, 0.5)]
+
+
+def _card(**fields):
+    return {"type": "image_occlusion", "occlusions": [{"left": 0.5, "top": 0.5, "width": 0.2, "height": 0.1}], **fields}
+
+
+def test_maps_onto_named_figure():
+    data = {"cards": [_card(figure=2)]}
+    _map_crop_occlusions(data, REGIONS)
+    assert data["cards"][0]["occlusions"] == [
+        {"left": 0.5 + 0.5 * 0.25, "top": 0.5 + 0.5 * 0.5, "width": 0.2 * 0.25, "height": 0.1 * 0.5}
+    ]
+    assert "figure" not in data["cards"][0]
+
+
+def test_single_figure_may_be_left_out():
+    data = {"cards": [_card()]}
+    _map_crop_occlusions(data, REGIONS[:1])
+    assert data["cards"][0]["occlusions"][0]["left"] == pytest.approx(0.1 + 0.5 * 0.5)
+
+
+@pytest.mark.parametrize("figure", [0, -1, 3, "x", None])
+def test_unknown_figure_clears_occlusions(figure):
+    data = {"cards": [_card(figure=figure)]}
+    _map_crop_occlusions(data, REGIONS)
+    assert data["cards"][0]["occlusions"] == []
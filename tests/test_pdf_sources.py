@@ -0,0 +1,75 @@
+"""Image-occlusion sources from a PDF: text-layer labels versus OCR."""
+
+from io import BytesIO
+
+import fitz
+import pytest
+from PIL import Image, ImageDraw
+
+from anki_niobium.io import DECORATIVE_RULES, niobium
+
+LABELS = [(10, 15, "Aorta"), (220, 20, "Atrium"), (15, 190, "Ventricle"), (200, 185, "Valve"), (110, 100, "Septum")]
+
+
+def _png():
+    image = Image.new("RGB", (300, 250), (200, 220, 240))
+    draw = ImageDraw.Draw(image)
+    for x in range(0, 300, 15):
+        draw.line([(x, 0), (300 - x, 250)], fill=(x % 255, 80, 120))
+    with BytesIO() as output:
+        image.save(output, format="PNG")
+        return output.getvalue()
+
+
+def _place(page, rect, stream, labelled):
+    page.insert_image(rect, stream=stream)
+    if labelled:
+        for dx, dy, text in LABELS:
+            page.insert_text((rect.x0 + dx, rect.y0 + dy), text, fontsize=9)
+
+
+def _sources(path):
+    return [results for _, results in niobium.extract_occlusion_sources(path, decorative=DECORATIVE_RULES)]
+
+
+@pytest.mark.parametrize("same_page", [True, False])
+def test_unlabelled_placement_after_labelled_one_is_ocrd(tmp_path, same_page):
+    doc = fitz.open()
+    stream = _png()
+    page = doc.new_page()
+    _place(page, fitz.Rect(50, 50, 350, 300), stream, labelled=True)
+    if not same_page:
+        page = doc.new_page()
+    _place(page, fitz.Rect(50, 450, 350, 700), stream, labelled=False)
+    path = tmp_path / "figures.pdf"
+    doc.save(path)
+
+    sources = _sources(path)
+    assert len(sources) == 2
+    assert [text for _, text, _ in sources[0]] == [text for _, _, text in LABELS]
+    assert sources[1] is None
+
+
+def test_labelled_placement_after_unlabelled_one_uses_text_layer(tmp_path):
+    doc = fitz.open()
+    stream = _png()
+    _place(doc.new_page(), fitz.Rect(50, 50, 350, 300), stream, labelled=False)
+    _place(doc.new_page(), fitz.Rect(50, 50, 350, 300), stream, labelled=True)
+    path = tmp_path / "figures.pdf"
+    doc.save(path)
+
+    sources = _sources(path)
+    assert len(sources) == 2
+    assert sources[0] is None
+    assert len(sources[1]) == len(LABELS)
+
+
+def test_repeated_unlabelled_image_is_yielded_once(tmp_path):
+    doc = fitz.open()
+    stream = _png()
+    for _ in range(3):
+        _place(doc.new_page(), fitz.Rect(50, 50, 350, 300), stream, labelled=False)
+    path = tmp_path / "figures.pdf"
+    doc.save(path)
+
+    assert _sources(path) == [None]
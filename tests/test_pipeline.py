@@ -0,0 +1,70 @@
+"""Pipeline ordering and backpressure."""
+
+import threading
+import time
+
+import pytest
+
+from anki_niobium.pipeline import Pipeline
+
+
+def test_order_kept_with_workers():
+    stages = [("square", lambda x: x * x, 4), ("inc", lambda x: x + 1, 2)]
+    assert list(Pipeline(stages, queue_size=2).run(range(50))) == [x * x + 1 for x in range(50)]
+
+
+def test_slow_first_item_keeps_buffer_bounded():
+    queue_size, workers = 2, 4
+    lock = threading.Lock()
+    counts = {"read": 0, "yielded": 0, "max_in_flight": 0}
+
+    def source():
+        for i in range(60):
+            with lock:
+                counts["read"] += 1
+                counts["max_in_flight"] = max(counts["max_in_flight"], counts["read"] - counts["yielded"])
+            yield i
+
+    def slow_first(x):
+        if x == 0:
+            time.sleep(0.5)
+        return x
+
+    out = []
+    for x in Pipeline([("work", slow_first, workers)], queue_size=queue_size).run(source()):
+        with lock:
+            counts["yielded"] += 1
+        out.append(x)
+    assert out == list(range(60))
+    # queue_size + workers in flight, plus the one item the producer holds while it waits
+    assert counts["max_in_flight"] <= queue_size + workers + 1
+
+
+def _tracked_source(closed, n=100):
+    try:
+        for i in range(n):
+            yield i
+    finally:
+        closed.set()
+
+
+def test_early_close_closes_source():
+    closed = threading.Event()
+    run = Pipeline([("work", lambda x: x, 2)], queue_size=2).run(_tracked_source(closed))
+    assert next(run) == 0
+    run.close()
+    assert closed.is_set()
+
+
+def test_stage_error_closes_source():
+    closed = threading.Event()
+
+    def fail_at_3(x):
+        if x == 3:
+            raise ValueError("boom")
+        return x
+
+    run = Pipeline([("work", fail_at_3, 2)], queue_size=2).run(_tracked_source(closed))
+    with pytest.raises(ValueError):
+        list(run)
+    assert closed.is_set()
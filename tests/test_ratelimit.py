@@ -0,0 +1,103 @@
+"""RequestScheduler bucket accounting: learned limits, retries and refunds."""
+
+import anthropic
+import pytest
+
+from anki_niobium.ratelimit import RequestScheduler
+
+REQUEST = object()
+
+
+class _Response:
+    """The parts of an HTTP response the SDK's errors read."""
+
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+        self.request = REQUEST
+
+
+class _Raw:
+    def __init__(self, headers):
+        self.headers = headers
+
+    def parse(self):
+        return None
+
+
+class _Client:
+    """Client whose create() raises the queued errors, then succeeds with headers."""
+
+    def __init__(self, errors=(), headers=None):
+        self.errors = list(errors)
+        self.headers = headers or {}
+        self.calls = 0
+        self.messages = self
+        self.with_raw_response = self
+
+    def with_options(self, **options):
+        return self
+
+    def create(self, **params):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return _Raw(self.headers)
+
+
+def _status_error(cls, status):
+    response = _Response(status, {"retry-after": "0"})
+    return cls("fake", response=response, body=None)
+
+
+def _levels(scheduler):
+    return {name: bucket.level for name, bucket in scheduler._buckets.items()}
+
+
+def test_learned_buckets_start_at_remaining():
+    headers = {
+        "anthropic-ratelimit-requests-limit": "50",
+        "anthropic-ratelimit-requests-remaining": "7",
+        "anthropic-ratelimit-input-tokens-limit": "40000",
+        "anthropic-ratelimit-input-tokens-remaining": "1000",
+    }
+    scheduler = RequestScheduler()
+    scheduler.create(_Client(headers=headers), {}, 100)
+    assert _levels(scheduler) == {"requests": 7, "input_tokens": 1000}
+
+
+def test_learned_buckets_without_remaining_start_full():
+    scheduler = RequestScheduler()
+    scheduler.create(_Client(headers={"anthropic-ratelimit-requests-limit": "50"}), {}, 100)
+    assert _levels(scheduler) == {"requests": 50}
+
+
+@pytest.mark.parametrize("error", [
+    _status_error(anthropic.RateLimitError, 429),
+    _status_error(anthropic.InternalServerError, 529),
+    anthropic.APIConnectionError(request=REQUEST),
+])
+def test_not_accepted_attempt_is_refunded(error):
+    scheduler = RequestScheduler(60, 60_000, retry={"backoff_base": 0.0})
+    client = _Client(errors=[error])
+    scheduler.create(client, {}, 100)
+    assert client.calls == 2
+    # One request and its tokens, not two; refilling only adds to the level
+    assert _levels(scheduler)["requests"] >= 59
+    assert _levels(scheduler)["requests"] < 60
+    assert 59_900 <= _levels(scheduler)["input_tokens"] < 59_950
+
+
+def test_retry_after_server_error_is_not_charged_again():
+    scheduler = RequestScheduler(60, 60_000, retry={"backoff_base": 0.0})
+    client = _Client(errors=[_status_error(anthropic.InternalServerError, 500)])
+    scheduler.create(client, {}, 100)
+    assert client.calls == 2
+    assert 59 <= _levels(scheduler)["requests"] < 60
+
+
+def test_failed_request_is_refunded():
+    scheduler = RequestScheduler(60, 60_000, retry={"rate_limit": 0})
+    with pytest.raises(anthropic.RateLimitError):
+        scheduler.create(_Client(errors=[_status_error(anthropic.RateLimitError, 429)]), {}, 100)
+    assert _levels(scheduler) == {"requests": 60, "input_tokens": 60_000}